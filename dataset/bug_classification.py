@@ -1,8 +1,12 @@
 import argparse
-import multiprocessing
+import os
+import queue
 import shutil
 import sys
+import threading
+import uuid
 from argparse import Namespace
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from pathlib import Path
 
 sys.path.append(str(Path(__file__).resolve().parent.parent))
@@ -67,6 +71,20 @@ SELECTED_BUGS = {
 }
 
 
+def move_to_trash(path: Path, trash_path: Path) -> Path:
+    """Rename the directory into the trash, much cheaper than removing it"""
+    trash_path.mkdir(parents=True, exist_ok=True)
+    trashed_path = trash_path / uuid.uuid4().hex
+    os.rename(path, trashed_path)
+    return trashed_path
+
+
+def empty_trash(trash_queue: queue.Queue):
+    """Remove the trashed directories until None is received"""
+    while (trashed_path := trash_queue.get()) is not None:
+        shutil.rmtree(trashed_path, ignore_errors=True)
+
+
 def run_one(proj, bug_id, config_file):
     args = Namespace(project=proj, bugID=bug_id, config=config_file)
     bug_info = BugInfo(args)
@@ -86,19 +104,23 @@ def run_one(proj, bug_id, config_file):
     ]
     test_class_names = set(test_class_names)
     buggy_class_names = set(buggy_class_names)
-    is_simple = False
-    for test_class_name in test_class_names:
-        for buggy_class_name in buggy_class_names:
-            if buggy_class_name in test_class_name:
-                is_simple = True
-                break
+    # a bug is simple if a buggy class is tested by a class of its name,
+    # the exact matches are checked first with a set intersection
+    is_simple = bool(buggy_class_names & test_class_names) or any(
+        buggy_class_name in test_class_name
+        for test_class_name in test_class_names
+        for buggy_class_name in buggy_class_names
+    )
 
-    # clean up
-    shutil.rmtree(bug_info.proj_tmp_path)
+    # clean up, the trashed checkout is removed by the main process
+    trashed_path = move_to_trash(
+        bug_info.proj_tmp_path, bug_info.checkout_tmp_path / "trash"
+    )
 
     return (
         is_simple,
         f"{proj}_{bug_id},{'|'.join(buggy_class_names)},{'|'.join(test_class_names)}",
+        trashed_path,
     )
 
 
@@ -106,13 +128,22 @@ def main(config, processes):
     version = "d4j2.0.1"
     root_path = Path(__file__).resolve().parent.parent
 
+    # the excluded bug ids as sets for constant time lookups
+    excluded_bugs = {
+        proj: frozenset(bugs[1]) for proj, bugs in ALL_BUGS[version].items()
+    }
+    unselected_bugs = {
+        proj: frozenset(bugs[1])
+        for proj, bugs in SELECTED_BUGS[version].items()
+    }
+
     bug_names = []
     for proj in ALL_BUGS[version]:
         for bug_id in ALL_BUGS[version][proj][0]:
-            if bug_id in ALL_BUGS[version][proj][1]:
+            if bug_id in excluded_bugs[proj]:
                 continue
 
-            if bug_id in SELECTED_BUGS[version][proj][1]:
+            if bug_id in unselected_bugs[proj]:
                 bug_path = (
                     root_path
                     / "dataset"
@@ -125,54 +156,58 @@ def main(config, processes):
                 continue
             bug_names.append(f"{proj}_{bug_id}")
 
-    run_failed = []
-    simple_bugs = []
-    complex_bugs = []
-    all_bugs = []
-    if processes > 1:
-        with multiprocessing.Pool(processes=processes) as pool:
-            async_results = []
-            for bug_name in bug_names:
-                proj, bug_id = bug_name.split("_")
-                async_result = pool.apply_async(
-                    run_one, (proj, bug_id, config)
-                )
-                async_results.append(async_result)
-
-            for i, async_result in enumerate(async_results):
-                try:
-                    is_simple, line = async_result.get()
-                    all_bugs.append(line)
-                    if is_simple:
-                        simple_bugs.append(line)
-                    else:
-                        complex_bugs.append(line)
-                except Exception as e:
-                    run_failed.append(f"{bug_names[i]} {str(e)}")
-    else:
-        for bug_name in bug_names:
-            proj, bug_id = bug_name.split("_")
-            is_simple, line = run_one(proj, bug_id, config)
-            all_bugs.append(line)
-            if is_simple:
-                simple_bugs.append(line)
-            else:
-                complex_bugs.append(line)
-
     run_failed_file = root_path / "dataset" / "bug_classification_failed.txt"
     simple_bugs_file = root_path / "dataset" / "simple_bugs.csv"
     complex_bugs_file = root_path / "dataset" / "complex_bugs.csv"
     all_bugs_file = root_path / "dataset" / "all_bugs.csv"
-    with open(run_failed_file, "w") as f:
-        f.write("\n".join(run_failed))
-    with open(simple_bugs_file, "w") as f:
-        f.write("\n".join(simple_bugs))
-    with open(complex_bugs_file, "w") as f:
-        f.write("\n".join(complex_bugs))
-    with open(all_bugs_file, "w") as f:
-        f.write("\n".join(all_bugs))
+
+    trash_queue = queue.Queue()
+    janitor = threading.Thread(
+        target=empty_trash, args=(trash_queue,), daemon=True
+    )
+    janitor.start()
+
+    # write each result as soon as it is ready, so the finished bugs are
+    # kept even if the run is interrupted
+    with open(run_failed_file, "w") as failed_f, open(
+        simple_bugs_file, "w"
+    ) as simple_f, open(complex_bugs_file, "w") as complex_f, open(
+        all_bugs_file, "w"
+    ) as all_f:
+
+        def write_result(is_simple, line, trashed_path):
+            trash_queue.put(trashed_path)
+            all_f.write(line + "\n")
+            if is_simple:
+                simple_f.write(line + "\n")
+            else:
+                complex_f.write(line + "\n")
+            for f in (all_f, simple_f, complex_f):
+                f.flush()
+
+        if processes > 1:
+            with ProcessPoolExecutor(max_workers=processes) as executor:
+                futures = {}
+                for bug_name in bug_names:
+                    proj, bug_id = bug_name.split("_")
+                    future = executor.submit(run_one, proj, bug_id, config)
+                    futures[future] = bug_name
+
+                # collect the results as soon as each bug is finished
+                for future in as_completed(futures):
+                    try:
+                        write_result(*future.result())
+                    except Exception as e:
+                        failed_f.write(f"{futures[future]} {str(e)}\n")
+                        failed_f.flush()
+        else:
+            for bug_name in bug_names:
+                proj, bug_id = bug_name.split("_")
+                write_result(*run_one(proj, bug_id, config))
 
     # clean up
+    trash_queue.put(None)
+    janitor.join()
     checkout_tmp_path = (
         root_path / "DebugResult" / BugInfo.get_config_hash(config)
     )
@@ -1,30 +1,54 @@
 import argparse
-import json
-import multiprocessing
-import pickle
+import functools
 import re
 import sys
 from argparse import Namespace
-from copy import deepcopy
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from itertools import repeat
 from pathlib import Path
 from pprint import pprint
-from typing import List
+from typing import Callable, Dict, List
 
-import networkx as nx
+import numpy as np
 import pandas as pd
-
-from src.interfaces.method_extractor import JMethod
-from src.schema import Tag, TestFailure
+from scipy.sparse.csgraph import shortest_path
 
 root = Path(__file__).resolve().parent
 sys.path.append(str(root))
 
 from src.config import BugInfo
 from src.interfaces.d4j import get_failed_tests, get_properties
+from src.interfaces.method_extractor import JMethod
+from src.repograph.graph_arrays import UndirectedGraphs, load_graph_nodes
+from src.schema import Tag, TestFailure
+from src.utils import dump_json, load_json
+
+# a predicted method with its confidence, e.g. "pkg.Cls.foo#1-5 (high)"
+CONFIDENCE_PATTERN = re.compile(r"(\S+) \((\w+)\)")
+CONFIDENCE_SCORES = {"low": 1, "medium": 2, "high": 3}
+
+
+def get_distance_rows(undirected_graphs: UndirectedGraphs, node: Tag):
+    """
+    Get the number of edges on the shortest paths from the node to all
+    nodes, in the dynamic graph and in the combined graph (inf if there is
+    no path). A single BFS per graph answers all queries of the node.
+    """
+    node_ids, dynamic_graph, combined_graph = undirected_graphs
+    return [
+        shortest_path(
+            graph, directed=False, unweighted=True, indices=node_ids[node]
+        )
+        for graph in (dynamic_graph, combined_graph)
+    ]
 
 
 def get_node_distance(
-    graph: nx.MultiDiGraph, node1: Tag, node2: Tag, simple=False
+    get_graphs: Callable[[], UndirectedGraphs],
+    distance_rows: Dict[Tag, List[np.ndarray]],
+    node1: Tag,
+    node2: Tag,
+    simple=False,
 ):
     # if the two nodes are the same, return 0
     if node1 == node2:
@@ -33,29 +57,31 @@ def get_node_distance(
     if simple:
         return 0.1
 
-    dynamic_graph = nx.Graph()
-    combined_graph = nx.Graph()
-    for edge in graph.edges(data=True):
-        combined_graph.add_edge(edge[0], edge[1])
-        if edge[2]["rel"] == "calls":
-            dynamic_graph.add_edge(edge[0], edge[1])
+    # the graphs are only built for the first query which needs them
+    undirected_graphs = get_graphs()
+    if node1 not in distance_rows:
+        distance_rows[node1] = get_distance_rows(undirected_graphs, node1)
+    target = undirected_graphs[0][node2]
 
-    # first try to find the shortest path in dynamic graph
-    try:
-        shortest_path = nx.shortest_path(dynamic_graph, node1, node2)
-        return len(shortest_path)
-    except Exception:
-        # if not found, try to find the shortest path in combined graph
-        try:
-            shortest_path = nx.shortest_path(combined_graph, node1, node2)
-            return len(shortest_path)
-        except Exception:
-            # if still not found, return -1
-            return -1
+    # first try to find the shortest path in dynamic graph,
+    # if not found, try to find the shortest path in combined graph
+    for row in distance_rows[node1]:
+        if np.isfinite(row[target]):
+            # the distance is the number of nodes on the path
+            return int(row[target]) + 1
+    # if still not found, return -1
+    return -1
+
+
+def get_function_nodes(nodes: List[Tag]) -> List[Tag]:
+    return [node for node in nodes if node.category == "function"]
 
 
 def get_relative_distance(
-    combined_graph: nx.MultiDiGraph,
+    function_nodes: List[Tag],
+    method_index: Dict[str, Tag],
+    get_graphs: Callable[[], UndirectedGraphs],
+    distance_rows: Dict[Tag, List[np.ndarray]],
     modified_methods: List[JMethod],
     method_id: str,
 ):
@@ -65,32 +91,26 @@ def get_relative_distance(
     For example, if the number of buggy methods is 3,
     the output will be a list contains 3 distances such as [2, 3, 4].
     """
-
-    def fuzzy_match(method_id_1: str, method_id_2: str):
-        if method_id_1 == method_id_2:
-            return True
-        if method_id_1.split(".")[-1] == method_id_2.split(".")[-1]:
-            return True
-        return False
-
     buggy_nodes = []
-    predict_node = None
-    should_find_methods = deepcopy(modified_methods)
-    for nodes in combined_graph.nodes(data=True):
-        if nodes[0].category == "function":
-            method_node: Tag = nodes[0]
-            for m in should_find_methods:
-                if method_node.outer_class in m.class_name:
-                    if m.name == method_node.name:
-                        if (
-                            m.loc[0][0] + 1 <= method_node.line[0]
-                            and m.loc[1][0] + 1 >= method_node.line[1]
-                        ):
-                            buggy_nodes.append(method_node)
-                            should_find_methods.remove(m)
-                            break
-            if fuzzy_match(method_node.method_id, method_id):
-                predict_node = method_node
+    # only the list is mutated, the methods themselves are never modified
+    should_find_methods = list(modified_methods)
+    for method_node in function_nodes:
+        if not should_find_methods:
+            break
+        for m in should_find_methods:
+            if method_node.outer_class in m.class_name:
+                if m.name == method_node.name:
+                    if (
+                        m.loc[0][0] + 1 <= method_node.line[0]
+                        and m.loc[1][0] + 1 >= method_node.line[1]
+                    ):
+                        buggy_nodes.append(method_node)
+                        should_find_methods.remove(m)
+                        break
+
+    # an exact match always has the same last identifier, so the fuzzy
+    # match is a lookup of the last identifier in the method index
+    predict_node = method_index.get(method_id.split(".")[-1])
 
     assert (
         len(should_find_methods) == 0
@@ -103,7 +123,8 @@ def get_relative_distance(
     distances = []
     for buggy_node in buggy_nodes:
         distance = get_node_distance(
-            combined_graph,
+            get_graphs,
+            distance_rows,
             buggy_node,
             predict_node,
             simple=True,
@@ -116,13 +137,25 @@ def get_relative_distance(
 def get_distance(
     test_failure_obj: TestFailure,
     ranked_methods: List[str],
-    combined_graph: nx.MultiDiGraph,
+    get_graphs: Callable[[], UndirectedGraphs],
+    function_nodes: List[Tag],
 ):
     modified_methods = test_failure_obj.buggy_methods
+    # the last function node wins, the same as scanning the graph
+    method_index = {
+        node.method_id.split(".")[-1]: node for node in function_nodes
+    }
+    # distances from each buggy node, computed on first use
+    distance_rows = {}
     evaluate_result = []
     for method_id in ranked_methods:
         distances = get_relative_distance(
-            combined_graph, modified_methods, method_id
+            function_nodes,
+            method_index,
+            get_graphs,
+            distance_rows,
+            modified_methods,
+            method_id,
         )
         if distances:
             rd = max([1 / (d + 1) for d in distances])
@@ -133,24 +166,27 @@ def get_distance(
     return evaluate_result
 
 
-def get_ranked(bug_info: BugInfo, combined_graph):
+@functools.lru_cache(maxsize=1024)
+def load_ranked_methods(ranked_result_file: Path, mtime_ns: int):
+    """Cached by path and modification time, changed files are reloaded"""
+    return load_json(ranked_result_file)
+
+
+def get_ranked(bug_info: BugInfo, function_nodes: List[Tag]):
     """
     Get the ranked methods from the combined graph.
     """
 
     ranked_result_file = bug_info.res_path / "method_rank_list.json"
     if ranked_result_file.exists():
-        with ranked_result_file.open("r") as f:
-            ranked_methods = json.load(f)
-            return ranked_methods
+        return load_ranked_methods(
+            ranked_result_file, ranked_result_file.stat().st_mtime_ns
+        )
 
     debug_result_file = bug_info.res_path / "debug_result.json"
-    debug_result = json.loads(debug_result_file.read_text())
+    debug_result = load_json(debug_result_file)
 
-    id_dict = {}
-    for node in combined_graph.nodes(data=True):
-        if node[0].category == "function":
-            id_dict[node[0].method_id] = node[0]
+    method_ids = {node.method_id for node in function_nodes}
 
     result = {}
     n_test = len(debug_result)
@@ -162,7 +198,7 @@ def get_ranked(bug_info: BugInfo, combined_graph):
             for line in pred_lines.split("\n"):
                 if line:
                     line = line.strip()
-                    if line in id_dict:
+                    if line in method_ids:
                         pred_method_ids.append(line)
                     else:
                         print(f"Method ID {line} not found in graph")
@@ -173,54 +209,39 @@ def get_ranked(bug_info: BugInfo, combined_graph):
                     result[pred_id] = 0
                 result[pred_id] = 1 / (n_pred * n_process * n_test)
 
-    suspicious_method_list = []
-    for key in result:
-        suspicious_method_list.append((key, result[key]))
     suspicious_method_list = sorted(
-        suspicious_method_list, key=lambda x: x[1], reverse=True
+        result.items(), key=lambda x: x[1], reverse=True
     )
-    if not suspicious_method_list:
-        ranked_methods = []
-    else:
-        ranked_methods = list(zip(*suspicious_method_list))[0]
+    ranked_methods = [x[0] for x in suspicious_method_list]
 
-    with ranked_result_file.open("w") as f:
-        json.dump(ranked_methods, f, indent=4)
+    dump_json(ranked_methods, ranked_result_file)
     return ranked_methods
 
 
-def get_ranked_with_confidence(bug_info: BugInfo, combined_graph):
+def get_ranked_with_confidence(
+    bug_info: BugInfo, function_nodes: List[Tag]
+):
     """
     Get the ranked methods from the combined graph.
     """
 
     def parse_line(line: str):
-        match = re.match(r"(\S+) \((\w+)\)", line)
+        match = CONFIDENCE_PATTERN.match(line)
         if match:
-            method_id = match.group(1)
-            confidence = match.group(2)
-            score = 0
-            if confidence == "low":
-                score = 1
-            elif confidence == "medium":
-                score = 2
-            elif confidence == "high":
-                score = 3
-            return method_id, score
+            method_id, confidence = match.groups()
+            return method_id, CONFIDENCE_SCORES.get(confidence, 0)
         return None
 
     ranked_result_file = bug_info.res_path / "debug_result.json"
     if ranked_result_file.exists():
-        with ranked_result_file.open("r") as f:
-            ranked_methods = json.load(f)
-            return ranked_methods
+        return load_ranked_methods(
+            ranked_result_file, ranked_result_file.stat().st_mtime_ns
+        )
 
     result = {}
     result_files = bug_info.res_path.rglob("search.json")
     pred_lines = [
-        json.loads(f.read_text())["memory"]["messages"][-1]["content"].split(
-            "\n"
-        )
+        load_json(f)["memory"]["messages"][-1]["content"].split("\n")
         for f in result_files
     ]
     pred_methods = []
@@ -233,37 +254,29 @@ def get_ranked_with_confidence(bug_info: BugInfo, combined_graph):
                     parsed_lines.append(parsed)
         pred_methods.append(parsed_lines)
 
-    id_dict = {}
-    for node in combined_graph.nodes(data=True):
-        if node[0].category == "function":
-            id_dict[node[0].method_id] = node[0]
+    method_ids = {node.method_id for node in function_nodes}
 
     n_test_cases = len(pred_methods)
     for methods in pred_methods:
         n_pred = len(methods)
         for method in methods:
             id, confidence = method
-            if id not in id_dict:
+            if id not in method_ids:
                 print(f"Method {id} not found in graph")
                 continue
             if method not in result:
                 result[method] = 0
             result[method] += 1 / n_pred
 
-    suspicious_method_list = []
-    for key in result:
-        score = result[key] / n_test_cases
-        suspicious_method_list.append((key[0], key[1], score))
+    # keys are (method_id, confidence), sort by score then confidence
     suspicious_method_list = sorted(
-        suspicious_method_list, key=lambda x: (x[2], x[1]), reverse=True
+        result.items(),
+        key=lambda x: (x[1] / n_test_cases, x[0][1]),
+        reverse=True,
     )
-    if not suspicious_method_list:
-        ranked_methods = []
-    else:
-        ranked_methods = list(zip(*suspicious_method_list))[0]
+    ranked_methods = [x[0][0] for x in suspicious_method_list]
 
-    with ranked_result_file.open("w") as f:
-        json.dump(ranked_methods, f, indent=4)
+    dump_json(ranked_methods, ranked_result_file)
     return ranked_methods
 
 
@@ -283,33 +296,75 @@ def evaluate(project, bugID, config):
     get_properties(bug_info)
     test_failure_obj = get_failed_tests(bug_info)
 
-    graph_file = bug_info.bug_path / "combined_graph.pkl"
-    with graph_file.open("rb") as f:
-        combined_graph = pickle.load(f)
+    nodes, get_graphs = load_graph_nodes(bug_info.bug_path)
+    function_nodes = get_function_nodes(nodes)
 
     # combine the result for all test cases to get the ranked methods
-    ranked_methods = get_ranked(bug_info, combined_graph)
-    # ranked_methods = get_ranked_with_confidence(bug_info, combined_graph)
+    ranked_methods = get_ranked(bug_info, function_nodes)
+    # ranked_methods = get_ranked_with_confidence(bug_info, function_nodes)
 
     # get the distance between the ranked methods and the buggy methods
-    distances = get_distance(test_failure_obj, ranked_methods, combined_graph)
-    with result_file.open("w") as f:
-        json.dump(distances, f)
+    distances = get_distance(
+        test_failure_obj, ranked_methods, get_graphs, function_nodes
+    )
+    dump_json(distances, result_file, indent=None)
+
+
+def get_metrics(distances: List[List[float]]) -> pd.DataFrame:
+    """
+    Compute the metrics of all bugs at once. The distance lists are padded
+    with NaN into a (n_bugs, max_len) array, a correct prediction is a
+    distance of 1.0.
+    """
+    lengths = np.array([len(d) for d in distances])
+    width = max(lengths.max(initial=0), 1)
+    dists = np.full((len(distances), width), np.nan)
+    for i, distance in enumerate(distances):
+        dists[i, : len(distance)] = distance
+
+    correct = dists == 1.0
+    has_correct = correct.any(axis=1)
+    first_correct = correct.argmax(axis=1)
+    num_correct = np.cumsum(correct, axis=1)
+
+    metrics = pd.DataFrame()
+    for k in [1, 3, 5]:
+        metrics[f"Top-{k}"] = has_correct & (first_correct < k)
+    # Average Precision over the positions of the correct predictions
+    precisions = num_correct / np.arange(1, width + 1)
+    metrics["MAP"] = (precisions * correct).sum(axis=1) / np.maximum(
+        num_correct[:, -1], 1
+    )
+    # Reciprocal Rank of the first correct prediction
+    metrics["MRR"] = np.where(has_correct, 1.0 / (first_correct + 1), 0.0)
+    # bugs without results have no RD (NaN), they are skipped by mean()
+    has_result = lengths > 0
+    for k in [1, 3, 5]:
+        rd = np.full(len(distances), np.nan)
+        rd[has_result] = np.nanmax(dists[has_result, :k], axis=1)
+        metrics[f"RD@{k}"] = rd
+    return metrics
+
+
+def evaluate_bug(bug_name, config_file):
+    """
+    Evaluate one bug in a worker process. Return the error message instead
+    of raising it, so that one failed bug does not stop the others.
+    """
+    proj, bug_id = bug_name.split("_")
+    try:
+        evaluate(proj, bug_id, config_file)
+    except Exception as e:
+        return str(e)
+    return None
 
 
 def print_result(bug_names, config_file):
     root_path = Path(__file__).resolve().parent
     config_name = Path(config_file).stem
-    output = {}
-    overall_metrics = {
-        "MAP": [],
-        "MRR": [],
-        "RD@1": [],
-        "RD@3": [],
-        "RD@5": [],
-    }
-    top_5_bugs = []
 
+    projects = []
+    distance_files = []
     for bug_name in bug_names:
         proj, bug_id = bug_name.split("_")
         distance_file = (
@@ -320,122 +375,49 @@ def print_result(bug_names, config_file):
         )
         if not distance_file.exists():
             raise FileNotFoundError(f"{distance_file} not found, please check")
-        with distance_file.open("r") as f:
-            distance = json.load(f)
-
-        if proj not in output:
-            output[proj] = {
-                "Top-1": 0,
-                "Top-3": 0,
-                "Top-5": 0,
-                "MAP": [],
-                "MRR": [],
-                "RD@1": [],
-                "RD@3": [],
-                "RD@5": [],
-            }
-
-        # Calculate MAP and MRR for this bug
-        if distance:
-            # Find all positions where distance is 1.0 (correct predictions)
-            correct_positions = [i for i, d in enumerate(distance) if d == 1.0]
-
-            if correct_positions:
-                # Calculate Average Precision for this bug
-                ap = 0.0
-                num_correct = 0
-                for i in range(len(distance)):
-                    if distance[i] == 1.0:
-                        num_correct += 1
-                        ap += num_correct / (i + 1)
-                ap = ap / len(correct_positions) if correct_positions else 0.0
-
-                # Calculate Reciprocal Rank (using the first correct prediction)
-                rr = 1.0 / (correct_positions[0] + 1)
-
-                output[proj]["MAP"].append(ap)
-                output[proj]["MRR"].append(rr)
-                overall_metrics["MAP"].append(ap)
-                overall_metrics["MRR"].append(rr)
-            else:
-                # No correct predictions
-                output[proj]["MAP"].append(0.0)
-                output[proj]["MRR"].append(0.0)
-                overall_metrics["MAP"].append(0.0)
-                overall_metrics["MRR"].append(0.0)
-        else:
-            print(f"Warning: {proj}-{bug_id} no results!")
-            output[proj]["MAP"].append(0.0)
-            output[proj]["MRR"].append(0.0)
-            overall_metrics["MAP"].append(0.0)
-            overall_metrics["MRR"].append(0.0)
-
-        for idx, d in enumerate(distance):
-            if d == 1.0:
-                if idx == 0:
-                    output[proj]["Top-1"] += 1
-                if idx < 3:
-                    output[proj]["Top-3"] += 1
-                if idx < 5:
-                    output[proj]["Top-5"] += 1
-                    top_5_bugs.append(f"{proj}-{bug_id}")
-                break
-        for i in [1, 3, 5]:
-            if distance[:i]:
-                rd_value = max(distance[:i])
-                output[proj][f"RD@{i}"].append(rd_value)
-                overall_metrics[f"RD@{i}"].append(rd_value)
-            else:
-                print(f"Warning: {proj}-{bug_id} no results!")
+        projects.append(proj)
+        distance_files.append(distance_file)
+
+    # overlap the reads of the many small result files
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        distances = list(executor.map(load_json, distance_files))
+    for bug_name, distance in zip(bug_names, distances):
+        if not distance:
+            print(f"Warning: {bug_name.replace('_', '-')} no results!")
+
+    metrics = get_metrics(distances)
+    metrics["project"] = projects
+    top_5_bugs = [
+        bug_name.replace("_", "-")
+        for bug_name, is_top_5 in zip(bug_names, metrics["Top-5"])
+        if is_top_5
+    ]
 
     # Calculate final metrics for each project
-    for proj in output:
-        # Calculate average MAP and MRR
-        output[proj]["MAP"] = (
-            sum(output[proj]["MAP"]) / len(output[proj]["MAP"])
-            if output[proj]["MAP"]
-            else 0.0
-        )
-        output[proj]["MRR"] = (
-            sum(output[proj]["MRR"]) / len(output[proj]["MRR"])
-            if output[proj]["MRR"]
-            else 0.0
-        )
-
-        for i in [1, 3, 5]:
-            output[proj][f"RD@{i}"] = (
-                sum(output[proj][f"RD@{i}"]) / len(output[proj][f"RD@{i}"])
-                if output[proj][f"RD@{i}"]
-                else 0.0
-            )
+    proj_metrics = metrics.groupby("project", sort=False).agg(
+        {
+            "Top-1": "sum",
+            "Top-3": "sum",
+            "Top-5": "sum",
+            "MAP": "mean",
+            "MRR": "mean",
+            "RD@1": "mean",
+            "RD@3": "mean",
+            "RD@5": "mean",
+        }
+    )
+    output = {
+        proj: {
+            key: (int(value) if key.startswith("Top") else float(value))
+            for key, value in row.fillna(0.0).items()
+        }
+        for proj, row in proj_metrics.iterrows()
+    }
 
     # Calculate overall metrics
     overall_summary = {
-        "MAP": (
-            sum(overall_metrics["MAP"]) / len(overall_metrics["MAP"])
-            if overall_metrics["MAP"]
-            else 0.0
-        ),
-        "MRR": (
-            sum(overall_metrics["MRR"]) / len(overall_metrics["MRR"])
-            if overall_metrics["MRR"]
-            else 0.0
-        ),
-        "RD@1": (
-            sum(overall_metrics["RD@1"]) / len(overall_metrics["RD@1"])
-            if overall_metrics["RD@1"]
-            else 0.0
-        ),
-        "RD@3": (
-            sum(overall_metrics["RD@3"]) / len(overall_metrics["RD@3"])
-            if overall_metrics["RD@3"]
-            else 0.0
-        ),
-        "RD@5": (
-            sum(overall_metrics["RD@5"]) / len(overall_metrics["RD@5"])
-            if overall_metrics["RD@5"]
-            else 0.0
-        ),
+        key: float(metrics[key].mean()) if metrics[key].notna().any() else 0.0
+        for key in ["MAP", "MRR", "RD@1", "RD@3", "RD@5"]
     }
 
     top_5_file = root_path / "utils" / f"{config_name}_top_5_bugs.txt"
@@ -449,7 +431,7 @@ def print_result(bug_names, config_file):
 
 
 def main(dataset_file, config_file, processes):
-    df = pd.read_csv(dataset_file, header=None)
+    df = pd.read_csv(dataset_file, header=None, usecols=[0])
     bug_names = df.iloc[:, 0].tolist()
 
     # TODO: evaluation: control bug for test
@@ -464,21 +446,22 @@ def main(dataset_file, config_file, processes):
     # ]
 
     if processes > 1:
-        with multiprocessing.Pool(processes=processes) as pool:
-            async_results = []
-            for bug_name in bug_names:
-                proj, bug_id = bug_name.split("_")
-                async_result = pool.apply_async(
-                    evaluate, (proj, bug_id, config_file)
-                )
-                async_results.append(async_result)
-
-            for i, async_result in enumerate(async_results):
-                try:
-                    async_result.get()
-                except Exception as e:
-                    print(f"{bug_names[i]} error: {str(e)}")
-                    return
+        # amortize the dispatch overhead over chunks of bugs
+        chunksize = max(1, len(bug_names) // (processes * 4))
+        failed = False
+        with ProcessPoolExecutor(max_workers=processes) as executor:
+            errors = executor.map(
+                evaluate_bug,
+                bug_names,
+                repeat(config_file),
+                chunksize=chunksize,
+            )
+            for bug_name, error in zip(bug_names, errors):
+                if error is not None:
+                    print(f"{bug_name} error: {error}")
+                    failed = True
+        if failed:
+            return
     else:
         for bug_name in bug_names:
             proj, bug_id = bug_name.split("_")
@@ -1,8 +1,10 @@
 import argparse
+import atexit
 import multiprocessing as mp
 import shutil
 import sys
 from argparse import Namespace
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
 import pandas as pd
@@ -20,9 +22,54 @@ from src.interfaces.d4j import (
 from src.repograph.construct_graph import create_repo_graph
 
 
-def worker(bug_name, config_file):
+# the config file shared by all tasks of a worker, set by `init_worker`
+_worker_config_file = None
+
+
+def init_worker(config_file):
+    """Set the config file once per worker instead of sending it per task"""
+    global _worker_config_file
+    _worker_config_file = config_file
+
+
+# the pool is reused by later `main` calls with the same arguments
+_pool = None
+_pool_args = None
+
+
+def get_pool(num_processes, config_file):
+    global _pool, _pool_args
+    if _pool_args != (num_processes, config_file):
+        close_pool()
+        # forked workers inherit the modules imported above instead of
+        # importing them again, whatever the platform default method is
+        _pool = mp.get_context("fork").Pool(
+            num_processes, initializer=init_worker, initargs=(config_file,)
+        )
+        _pool_args = (num_processes, config_file)
+    return _pool
+
+
+def close_pool():
+    global _pool, _pool_args
+    if _pool is not None:
+        _pool.close()
+        _pool.join()
+    _pool = None
+    _pool_args = None
+
+
+atexit.register(close_pool)
+
+
+def worker(bug_name):
+    """Report the error of a bug instead of stopping the whole pool"""
     proj, bug_id = bug_name.split("_")
-    run_one(proj, bug_id, config_file)
+    try:
+        proj_tmp_path = run_one(proj, bug_id, _worker_config_file)
+    except Exception as e:
+        return bug_name, None, str(e)
+    return bug_name, proj_tmp_path, None
 
 
 def check_exists(bug_name):
@@ -42,29 +89,34 @@ def check_exists(bug_name):
 
 
 def main(dataset_file, config_file, num_processes):
-    df = pd.read_csv(dataset_file, header=None)
+    df = pd.read_csv(dataset_file, header=None, usecols=[0])
     bug_names = df.iloc[:, 0].tolist()
 
     # TODO: Control bug for preprocess
-    bug_names = ["Chart_1"]
+    target_bugs = {"Chart_1"}
+    bug_names = [b for b in bug_names if b in target_bugs]
 
+    # filter before starting the workers, so no worker is left idle
+    bug_names = [b for b in bug_names if not check_exists(b)]
+    num_processes = min(num_processes, len(bug_names))
+
+    # remove the checkouts in the background so the next bug can start,
+    # in this process so that all removals are done before the clean up
+    cleaner = ThreadPoolExecutor(max_workers=1)
+    removals = []
     if num_processes > 1:
         preprocess_failed = []
-        with mp.Pool(num_processes) as pool:
-            async_results = []
-            for bug_name in bug_names:
-                if check_exists(bug_name):
-                    continue
-                async_result = pool.apply_async(
-                    worker, (bug_name, config_file)
-                )
-                async_results.append(async_result)
-
-            for i, async_result in enumerate(async_results):
-                try:
-                    async_result.get()
-                except Exception as e:
-                    preprocess_failed.append(f"{bug_names[i]} {str(e)}")
+        # amortize the dispatch overhead over chunks of bugs
+        chunksize = max(1, len(bug_names) // (num_processes * 4))
+        pool = get_pool(num_processes, config_file)
+        # report each bug as soon as it is done, in any order
+        for bug_name, proj_tmp_path, error in pool.imap_unordered(
+            worker, bug_names, chunksize=chunksize
+        ):
+            if error is not None:
+                preprocess_failed.append(f"{bug_name} {error}")
+            else:
+                removals.append(cleaner.submit(shutil.rmtree, proj_tmp_path))
 
         preprocess_failed_file = root / "preprocess_failed.txt"
         if preprocess_failed:
@@ -72,18 +124,21 @@ def main(dataset_file, config_file, num_processes):
                 f.write("\n".join(preprocess_failed))
     else:
         for bug_name in bug_names:
-            if check_exists(bug_name):
-                continue
-            worker(bug_name, config_file)
+            proj_tmp_path = run_one(*bug_name.split("_"), config_file)
+            removals.append(cleaner.submit(shutil.rmtree, proj_tmp_path))
 
     # clean up
+    cleaner.shutdown(wait=True)
+    for removal in removals:
+        removal.result()
     checkout_tmp_path = (
         root / "DebugResult" / BugInfo.get_config_hash(config_file)
     )
     shutil.rmtree(checkout_tmp_path)
 
 
-def run_one(proj, bug_id, config_file):
+def run_one(proj, bug_id, config_file) -> Path:
+    """Preprocess a bug, returns its checkout for the caller to remove"""
     args = Namespace(project=proj, bugID=bug_id, config=config_file)
     bug_info = BugInfo(args)
 
@@ -96,9 +151,7 @@ def run_one(proj, bug_id, config_file):
 
     # create the raw repository graph
     create_repo_graph(bug_info, test_failure_obj)
-
-    # clean up
-    shutil.rmtree(bug_info.proj_tmp_path)
+    return bug_info.proj_tmp_path
 
 
 if __name__ == "__main__":
@@ -1,6 +1,9 @@
 import argparse
+import atexit
 import multiprocessing
+import os
 import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from pathlib import Path
 
 import pandas as pd
@@ -8,20 +11,82 @@ import pandas as pd
 root = Path(__file__).resolve().parent
 sys.path.append(str(root))
 
-import subprocess
+from run import main as run_main
 
+# the config file shared by all tasks of a worker, set by `init_worker`
+_worker_config_file = None
 
-def run_script(project, bugID, config):
-    cmd = (
-        f"python run.py --project {project} --bugID {bugID} --config {config}"
-    )
-    subprocess.run(cmd.split())
+
+def init_worker(config_file):
+    """Set the config file once per worker instead of sending it per task"""
+    global _worker_config_file
+    _worker_config_file = config_file
+
+
+# the pool is reused by later `main` calls with the same arguments
+_pool = None
+_pool_args = None
+
+
+def get_pool(num_processes, config_file):
+    global _pool, _pool_args
+    if _pool_args != (num_processes, config_file):
+        close_pool()
+        # the debug agent starts its own processes, which the daemonic
+        # workers of multiprocessing.Pool are not allowed to do
+        _pool = ProcessPoolExecutor(
+            num_processes,
+            mp_context=multiprocessing.get_context("fork"),
+            initializer=init_worker,
+            initargs=(config_file,),
+        )
+        _pool_args = (num_processes, config_file)
+    return _pool
+
+
+def close_pool():
+    global _pool, _pool_args
+    if _pool is not None:
+        _pool.shutdown()
+    _pool = None
+    _pool_args = None
+
+
+atexit.register(close_pool)
+
+
+def worker(bug_name):
+    """Report the error of a bug instead of stopping the whole pool"""
+    proj, bug_id = bug_name.split("_")
+    try:
+        run_main(proj, bug_id, _worker_config_file)
+    except Exception as e:
+        return bug_name, str(e)
+    return bug_name, None
+
+
+def get_done_bugs(config_file):
+    """
+    Get the `{proj}-{bug_id}` names of the bugs which already have a debug
+    result, with one directory scan per project instead of a stat per bug.
+    """
+    result_path = root / "DebugResult" / Path(config_file).stem
+    done_bugs = set()
+    if not result_path.is_dir():
+        return done_bugs
+    for proj_entry in os.scandir(result_path):
+        if not proj_entry.is_dir():
+            continue
+        for bug_entry in os.scandir(proj_entry.path):
+            result_file = os.path.join(bug_entry.path, "debug_result.json")
+            if bug_entry.is_dir() and os.path.isfile(result_file):
+                done_bugs.add(bug_entry.name)
+    return done_bugs
 
 
 def main(dataset_file, config_file, processes):
-    df = pd.read_csv(dataset_file, header=None)
+    df = pd.read_csv(dataset_file, header=None, usecols=[0])
     bug_names = df.iloc[:, 0].tolist()
-    root_path = Path(__file__).resolve().parent
 
     # TODO: Control bug for test
     # bug_names = [
@@ -35,45 +100,22 @@ def main(dataset_file, config_file, processes):
 
     run_failed = []
 
+    done_bugs = get_done_bugs(config_file)
+    bug_names = [b for b in bug_names if b.replace("_", "-") not in done_bugs]
+    processes = min(processes, len(bug_names))
     if processes > 1:
-        with multiprocessing.Pool(processes=processes) as pool:
-            async_results = []
-
-            for bug_name in bug_names:
-                proj, bug_id = bug_name.split("_")
-                debug_result_file = (
-                    root_path
-                    / "DebugResult"
-                    / Path(config_file).stem
-                    / proj
-                    / f"{proj}-{bug_id}"
-                    / "debug_result.json"
-                )
-                if not debug_result_file.exists():
-                    async_result = pool.apply_async(
-                        run_script, (proj, bug_id, config_file)
-                    )
-                    async_results.append(async_result)
-
-            for i, async_result in enumerate(async_results):
-                try:
-                    async_result.get()
-                except Exception as e:
-                    print(e)
-                    run_failed.append(bug_names[i])
+        pool = get_pool(processes, config_file)
+        futures = [pool.submit(worker, bug_name) for bug_name in bug_names]
+        # report each bug as soon as it is done, in any order
+        results = (future.result() for future in as_completed(futures))
     else:
-        for bug_name in bug_names:
-            proj, bug_id = bug_name.split("_")
-            debug_result_file = (
-                root_path
-                / "DebugResult"
-                / Path(config_file).stem
-                / proj
-                / f"{proj}-{bug_id}"
-                / "debug_result.json"
-            )
-            if not debug_result_file.exists():
-                run_script(proj, bug_id, config_file)
+        init_worker(config_file)
+        results = map(worker, bug_names)
+
+    for bug_name, error in results:
+        if error is not None:
+            print(error)
+            run_failed.append(bug_name)
 
     if run_failed:
         run_failed_file = root / "run_all_failed.txt"
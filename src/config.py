@@ -1,3 +1,4 @@
+import functools
 import hashlib
 import logging
 import logging.config
@@ -5,15 +6,38 @@ import os
 import sys
 from pathlib import Path
 from time import time
-from typing import Optional
+from typing import Dict, Optional, Tuple
 
 import yaml
 
+# the libyaml based loader is several times faster, if PyYAML was built with it
+YamlLoader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+
+
+class CachedTimeFormatter(logging.Formatter):
+    """Formatter which formats the timestamp of each second only once.
+    Only valid for date formats without sub-second fields."""
+
+    def __init__(self, fmt=None, datefmt=None):
+        super().__init__(fmt, datefmt)
+        # (second, formatted time), replaced as a whole to be thread-safe
+        self.cached_time = (None, "")
+
+    def formatTime(self, record, datefmt=None):
+        second = int(record.created)
+        cached_time = self.cached_time
+        if cached_time[0] != second:
+            cached_time = (second, super().formatTime(record, datefmt))
+            self.cached_time = cached_time
+        return cached_time[1]
+
+
 log_config = {
     "version": 1,
     "formatters": {
         "simple": {
-            "format": "%(levelname)s - %(asctime)s - %(message)s",
+            "()": CachedTimeFormatter,
+            "fmt": "%(levelname)s - %(asctime)s - %(message)s",
             "datefmt": "%Y-%m-%d %H:%M:%S",
         }
     },
@@ -53,6 +77,23 @@ class Config:
         }
 
 
+@functools.lru_cache(maxsize=32)
+def load_config(config_file: Path, mtime_ns: int) -> Config:
+    """
+    Parse a config file once per process, the bugs of a run share it.
+    The modification time is part of the key, so an edited config is
+    parsed again. The returned config must be treated as read-only.
+    """
+    with config_file.open("r") as f:
+        return Config(yaml.load(f, Loader=YamlLoader))
+
+
+@functools.lru_cache(maxsize=4096)
+def get_class_rel_path(class_name: str) -> str:
+    """The source file of a class, inner classes live in the outer one"""
+    return class_name.split("$", 1)[0].replace(".", "/") + ".java"
+
+
 class BugInfo:
     def __init__(self, args, eval=False):
         self.root_path = Path(__file__).resolve().parents[1]
@@ -84,6 +125,8 @@ class BugInfo:
         self.proj_tmp_path = self.checkout_tmp_path / self.bug_name
         self.buggy_path = self.proj_tmp_path / "buggy"
         self.fixed_path = self.proj_tmp_path / "fixed"
+        # class lookups join plain strings, no Path objects on a miss
+        self.buggy_dir = str(self.buggy_path)
 
         # temp paths for each test case
         self.failed_test_names = []
@@ -92,16 +135,19 @@ class BugInfo:
         self.test_prefix = None
         self.src_class_prefix = None
         self.test_class_prefix = None
+        # stack traces repeat the same classes, remember the lookups
+        self.class_files: Dict[Tuple[str, str, str], Optional[Path]] = {}
 
         if not eval:
             # Create directories if they don't exist
             for path in [self.res_path, self.bug_path]:
                 path.mkdir(parents=True, exist_ok=True)
 
-        if Path(args.config).exists():
+        if config_file.exists():
             # read config file
-            with Path(args.config).open("r") as f:
-                self.config = Config(yaml.safe_load(f))
+            self.config = load_config(
+                config_file, config_file.stat().st_mtime_ns
+            )
 
             # dependencies
             self.java_agent_lib = Path(self.config.dependencies.java_agent_lib)
@@ -118,27 +164,33 @@ class BugInfo:
             logging.config.dictConfig(log_config)
             self.logger = logging.getLogger("default")
 
-    def get_class_file(self, class_name) -> Optional[Path]:
-        class_file = (
-            self.buggy_path
-            / self.src_prefix
-            / Path(class_name.split("$")[0].replace(".", "/") + ".java")
-        )
-
-        if not class_file.exists():
-            class_file = (
-                self.buggy_path
-                / self.test_prefix
-                / Path(class_name.split("$")[0].replace(".", "/") + ".java")
-            )
-
-        if not class_file.exists():
-            return None
+    @property
+    def json_indent(self) -> Optional[int]:
+        """Indent of the JSON result files, `hyper.compact_json` disables it"""
+        hyper = getattr(self.config, "hyper", None)
+        return None if getattr(hyper, "compact_json", False) else 2
 
+    def get_class_file(self, class_name) -> Optional[Path]:
+        key = (class_name, self.src_prefix, self.test_prefix)
+        try:
+            return self.class_files[key]
+        except KeyError:
+            pass
+
+        rel_path = get_class_rel_path(class_name)
+        class_file = None
+        for prefix in (self.src_prefix, self.test_prefix):
+            candidate = os.path.join(self.buggy_dir, prefix, rel_path)
+            if os.path.isfile(candidate):
+                class_file = Path(candidate)
+                break
+        self.class_files[key] = class_file
         return class_file
 
     @staticmethod
+    @functools.lru_cache(maxsize=8)
     def get_config_hash(config_file: Path) -> str:
-        md5_hash = hashlib.md5()
-        md5_hash.update(str(config_file).encode("utf-8"))
-        return md5_hash.hexdigest()
+        # 16 bytes keep the checkout directory names as long as with MD5
+        return hashlib.blake2b(
+            str(config_file).encode("utf-8"), digest_size=16
+        ).hexdigest()
@@ -1,9 +1,7 @@
-import copy
-import json
+import os
 import threading
-import time
 from concurrent.futures import Future, ThreadPoolExecutor
-from dataclasses import asdict, dataclass, field
+from dataclasses import dataclass, field
 from typing import Dict, List
 
 from anthropic.types import ToolUseBlock
@@ -19,8 +17,54 @@ from src.core.prompt import (
     SEARCH_AGENT_USER_PROMPT,
     TOOLS_AUTOFL,
 )
+from src.core.utils import PromptTemplate
 from src.repograph.graph_searcher import RepoSearcher
 from src.schema import SearchInput, VerifyInput
+from src.utils import dump_json
+
+SEARCH_AGENT_USER_TEMPLATE = PromptTemplate(SEARCH_AGENT_USER_PROMPT)
+
+# every search starts with a scripted call of `get_covered_classes`, the
+# messages are never modified in place so all searches share this one
+DEFAULT_TOOL_CALL_ID = "call_default"
+DEFAULT_TOOL_CALL_MSG = OpenAIBackend.recover_msg(
+    {
+        "content": None,
+        "refusal": None,
+        "role": "assistant",
+        "audio": None,
+        "function_call": None,
+        "tool_calls": [
+            {
+                "id": DEFAULT_TOOL_CALL_ID,
+                "function": {
+                    "arguments": "{}",
+                    "name": "get_covered_classes",
+                },
+                "type": "function",
+            }
+        ],
+    }
+)
+
+# the search threads are shared by the agents of a process, which run one
+# test case after another, instead of starting a new pool per test case
+_search_pool = None
+_search_pool_key = None
+
+
+def get_search_pool(max_workers: int) -> ThreadPoolExecutor:
+    global _search_pool, _search_pool_key
+    # threads do not survive a fork, a forked worker needs its own pool
+    key = (os.getpid(), max_workers)
+    if _search_pool_key != key:
+        if _search_pool is not None and _search_pool_key[0] == key[0]:
+            _search_pool.shutdown(wait=False)
+        _search_pool = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="search"
+        )
+        _search_pool_key = key
+    return _search_pool
 
 
 @dataclass
@@ -56,50 +100,59 @@ class AutoflAgent:
         assert self.org == "openai"
         self.llm_backend = OpenAIBackend
         self.tool_set = TOOLS_AUTOFL
+        # all search processes share one client, the OpenAI client is
+        # thread-safe and keeps a single connection pool
+        self.llm = self.llm_backend(
+            api_key=self.bug_info.config.search_model.api_key,
+            base_url=self.bug_info.config.search_model.base_url,
+        )
 
         self.processes: Dict[int, ProcessState] = {}
-        self.futures: List[Future] = []
+        # the futures of the running and finished leaf processes
+        self.futures: Dict[int, Future] = {}
         self.process_counter = 0
         self.process_lock = threading.Lock()
-        self.thread_pool = ThreadPoolExecutor(
-            max_workers=bug_info.config.hyper.search_workers,
+        # number of submitted processes which have not finished yet
+        self.in_flight = 0
+        self.all_done = threading.Condition(self.process_lock)
+        self.thread_pool = get_search_pool(
+            bug_info.config.hyper.search_workers
         )
-        self.futures = []
 
     def create_process(
         self, input: SearchInput, parent_id=None
     ) -> ProcessState:
+        # only the id allocation and the registration need the lock, the
+        # state (memory fork) is built outside of it
         with self.process_lock:
             process_id = self.process_counter
-            if parent_id is not None:
-                parent_process = self.processes[parent_id]
-                self.processes[process_id] = ProcessState(
-                    input=input,
-                    llm=self.llm_backend(
-                        api_key=self.bug_info.config.search_model.api_key,
-                        base_url=self.bug_info.config.search_model.base_url,
-                    ),
-                    memory=copy.deepcopy(parent_process.memory),
-                    id=f"{parent_process.id}-{process_id}",
-                    function_calls=copy.deepcopy(
-                        parent_process.function_calls
-                    ),
-                )
-            else:
-                self.processes[process_id] = ProcessState(
-                    input=input,
-                    llm=self.llm_backend(
-                        api_key=self.bug_info.config.search_model.api_key,
-                        base_url=self.bug_info.config.search_model.base_url,
-                    ),
-                    memory=Memory(
-                        self.debug_prompt,
-                        self.bug_info.config.search_model.model,
-                    ),
-                    id=str(process_id),
-                )
             self.process_counter += 1
-            return process_id
+            parent_process = (
+                self.processes[parent_id] if parent_id is not None else None
+            )
+
+        if parent_process is not None:
+            process = ProcessState(
+                input=input,
+                llm=self.llm,
+                memory=parent_process.memory.fork(),
+                id=f"{parent_process.id}-{process_id}",
+                function_calls=parent_process.function_calls[:],
+            )
+        else:
+            process = ProcessState(
+                input=input,
+                llm=self.llm,
+                memory=Memory(
+                    self.debug_prompt,
+                    self.bug_info.config.search_model.model,
+                ),
+                id=str(process_id),
+            )
+
+        with self.process_lock:
+            self.processes[process_id] = process
+        return process_id
 
     def save_memory(self):
         memory_cache = {}
@@ -110,7 +163,9 @@ class AutoflAgent:
             }
         # save the memory cache to a file
         search_file = process.input.output_path / "search.json"
-        search_file.write_text(json.dumps(memory_cache, indent=2))
+        dump_json(
+            memory_cache, search_file, indent=self.bug_info.json_indent
+        )
         self.bug_info.logger.info(f"Save search memory cache to {search_file}")
 
     def init_memory(self, input: SearchInput, process_id: str) -> None:
@@ -118,30 +173,12 @@ class AutoflAgent:
         default_messages = [
             {
                 "role": "user",
-                "content": SEARCH_AGENT_USER_PROMPT.format(**asdict(input)),
+                "content": SEARCH_AGENT_USER_TEMPLATE.format(**vars(input)),
             },
-            self.llm_backend.recover_msg(
-                {
-                    "content": None,
-                    "refusal": None,
-                    "role": "assistant",
-                    "audio": None,
-                    "function_call": None,
-                    "tool_calls": [
-                        {
-                            "id": "call_default",
-                            "function": {
-                                "arguments": "{}",
-                                "name": "get_covered_classes",
-                            },
-                            "type": "function",
-                        }
-                    ],
-                }
-            ),
+            DEFAULT_TOOL_CALL_MSG,
             {
                 "role": "tool",
-                "tool_call_id": "call_default",
+                "tool_call_id": DEFAULT_TOOL_CALL_ID,
                 "content": self.functions["get_covered_classes"](),
             },
         ]
@@ -154,19 +191,17 @@ class AutoflAgent:
         entry_process_id = self.create_process(input)
         self.init_memory(input, entry_process_id)
 
-        entry_future = self.thread_pool.submit(
-            self.run_process, entry_process_id
-        )
-        entry_future.process_id = entry_process_id
-        self.futures.append(entry_future)
+        self.submit_process(entry_process_id)
 
-        # wait for all futures to finish
-        while not all(future.done() for future in self.futures):
-            time.sleep(1)
+        # the running processes submit their children before they finish,
+        # so the search is over once no submitted process is left
+        with self.all_done:
+            while self.in_flight:
+                self.all_done.wait()
 
         # check for exceptions in the futures
         has_exception = False
-        for future in self.futures:
+        for future in self.futures.values():
             try:
                 result = future.result()
             except Exception as e:
@@ -182,6 +217,27 @@ class AutoflAgent:
             )
         self.save_memory()
 
+    def submit_process(self, process_id: int, single_tool_call_msg=None):
+        with self.process_lock:
+            self.in_flight += 1
+        self.start_process(process_id, single_tool_call_msg)
+
+    def start_process(self, process_id: int, single_tool_call_msg=None):
+        # the process must be counted in `in_flight` already
+        future = self.thread_pool.submit(
+            self.run_process, process_id, single_tool_call_msg
+        )
+        future.process_id = process_id
+        with self.process_lock:
+            self.futures[process_id] = future
+        future.add_done_callback(self.on_process_done)
+
+    def on_process_done(self, future: Future):
+        with self.all_done:
+            self.in_flight -= 1
+            if not self.in_flight:
+                self.all_done.notify_all()
+
     def execute_function(
         self,
         tool_call: ChatCompletionMessageToolCall | ToolUseBlock,
@@ -202,7 +258,7 @@ class AutoflAgent:
             error_message=process.input.error_message,
             method_id=method_id,
             suspected_issue=suspected_issue,
-            method_code=method.code,
+            method_code=self.searcher.get_method_code(method),
             output_dir=process.input.output_path,
             method=method,
         )
@@ -214,29 +270,41 @@ class AutoflAgent:
         message: ChatCompletionMessageToolCall | ToolUseBlock,
     ) -> None:
         tool_calls = self.llm_backend.get_tool_calls(message)
+        parent_process = self.processes[process_id]
+        # build the children without the lock, only the first tool call is
+        # followed like AutoFL does
+        children = []
         for i in range(len(tool_calls[:1])):
-            # create a new process for each tool call
-            new_process_id = self.create_process(
-                input=copy.deepcopy(self.processes[process_id].input),
-                parent_id=process_id,
+            process = ProcessState(
+                input=parent_process.input,
+                llm=self.llm,
+                memory=parent_process.memory.fork(),
+                id=parent_process.id,
+                function_calls=parent_process.function_calls[:],
             )
             single_tool_call_message = (
                 self.llm_backend.get_single_tool_call_msg(message, i)
             )
-            future = self.thread_pool.submit(
-                self.run_process,
-                new_process_id,
-                single_tool_call_message,
-            )
-            future.process_id = new_process_id
-            self.futures.append(future)
+            children.append((process, single_tool_call_message))
 
-        # remove the parent process and its futures
+        # register the children and remove the parent process and its
+        # future at once
+        new_process_ids = []
         with self.process_lock:
+            for process, _ in children:
+                new_process_id = self.process_counter
+                self.process_counter += 1
+                process.id = f"{parent_process.id}-{new_process_id}"
+                self.processes[new_process_id] = process
+                new_process_ids.append(new_process_id)
+            self.in_flight += len(children)
             self.processes.pop(process_id)
-            for future in self.futures:
-                if future.process_id == process_id:
-                    self.futures.remove(future)
+            self.futures.pop(process_id, None)
+
+        for new_process_id, (_, single_tool_call_message) in zip(
+            new_process_ids, children
+        ):
+            self.start_process(new_process_id, single_tool_call_message)
 
     def run_process(self, process_id: str, single_tool_call_msg=None) -> None:
         process = self.processes[process_id]
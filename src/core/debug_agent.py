@@ -1,30 +1,33 @@
+import asyncio
 import json
 import pickle
-import time
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor, wait
 from dataclasses import dataclass
-from multiprocessing import Pool
-from multiprocessing.pool import AsyncResult
+from multiprocessing.shared_memory import SharedMemory
 from pathlib import Path
-from typing import Any, Dict, List
+from typing import Any, Dict, List, Tuple
 
 from src.config import BugInfo
 from src.core.autofl_agent import AutoflAgent
 from src.core.llm_backend import AnthropicBackend, OpenAIBackend
 from src.core.memory import Memory
 from src.core.pingfl_agent import PingflAgent
+from src.core.plan_cache import PlanCache
 from src.core.prompt import (
     SINGLE_RESULT_TEMPLATE,
     SUMMARIZE_SYSTEM_PROMPT,
     SUMMARIZE_USER_PROMPT,
 )
-from src.core.utils import extract_json_block
+from src.core.utils import extract_json_object
+from src.core.verify_agent import VerifyAgent
 from src.interfaces.d4j import (
     get_test_case_dataset_path,
     get_test_case_output_path,
 )
 from src.repograph.graph_searcher import RepoSearcher
 from src.schema import DebugInput, SearchInput, TestFailure
-from src.utils import Timer
+from src.utils import Timer, dump_json, load_json
 
 
 @dataclass
@@ -53,19 +56,63 @@ def get_agent(bug_info: BugInfo):
         return AnthropicBackend
 
 
-def debug_process(bug_info: BugInfo, debug_state: DebugState):
+# the verify agent only depends on the bug, so each worker builds it once
+_worker_verify_agent: VerifyAgent | None = None
+
+
+def init_debug_worker(bug_info: BugInfo):
+    """Initialize the agents shared by all test cases of a worker"""
+    global _worker_verify_agent
+    if hasattr(bug_info.config, "verify_model"):
+        _worker_verify_agent = VerifyAgent(
+            bug_info=bug_info,
+            org=bug_info.config.verify_model.org,
+        )
+
+
+def debug_process(bug_info: BugInfo, debug_state: DebugState) -> str:
     """Debug process for a single test case"""
-    searcher = RepoSearcher(debug_state.input.repo_graph)
+    # results are saved to the output path, only the test name is sent back
+    search_input = debug_state.prepare_search_input()
+    search_file = search_input.output_path / "search.json"
+
+    # reuse the search result of a test case failed in the same way
+    plan_cache = None
+    if getattr(bug_info.config.hyper, "plan_cache", False):
+        plan_cache = PlanCache(bug_info.res_path / "plan_cache")
+        cache_file = plan_cache.load(search_input.error_message, search_file)
+        if cache_file is not None:
+            bug_info.logger.info(
+                f"{search_input.test_name} - reuse search result {cache_file}"
+            )
+            return search_input.test_name
+
+    # the graph is loaded in the worker to avoid pickling it through the pool
+    repo_graph_file = debug_state.input.repo_graph_file
+    frozen_file = repo_graph_file.with_suffix(".frozen.pkl")
+    if (
+        frozen_file.exists()
+        and frozen_file.stat().st_mtime >= repo_graph_file.stat().st_mtime
+    ):
+        searcher = RepoSearcher.thaw(frozen_file)
+    else:
+        with repo_graph_file.open("rb") as f:
+            repo_graph = pickle.load(f)
+        searcher = RepoSearcher(repo_graph)
+        searcher.freeze(frozen_file)
     debug_name = bug_info.config.agent
     if debug_name == "autofl":
         search_agent = AutoflAgent(bug_info=bug_info, searcher=searcher)
     elif debug_name == "pingfl":
-        search_agent = PingflAgent(bug_info=bug_info, searcher=searcher)
+        search_agent = PingflAgent(
+            bug_info=bug_info,
+            searcher=searcher,
+            verify_agent=_worker_verify_agent,
+        )
     else:
         raise ValueError(f"Unknown agent name: {debug_name}")
 
     # perform search
-    search_input = debug_state.prepare_search_input()
     with Timer(
         bug_info.logger,
         f"{search_input.test_name} - search",
@@ -77,13 +124,53 @@ def debug_process(bug_info: BugInfo, debug_state: DebugState):
         #     )
         #     return
 
-        search_agent.run(search_input)
+        if isinstance(search_agent, PingflAgent):
+            asyncio.run(search_agent.run(search_input))
+        else:
+            search_agent.run(search_input)
+
+    if plan_cache is not None:
+        plan_cache.store(search_input.error_message, search_file)
+    return search_input.test_name
+
+
+# debug states larger than this are handed to workers via shared memory
+SHM_THRESHOLD = 64 * 1024
+
+
+def load_debug_state(handle: DebugState | Tuple[str, int]) -> DebugState:
+    """Load a debug state passed directly or as a (name, size) shared memory handle"""
+    if isinstance(handle, DebugState):
+        return handle
+    shm_name, size = handle
+    # the parent process owns the block, its unlink also unregisters the
+    # block from the resource tracker shared with the workers
+    shm = SharedMemory(name=shm_name)
+    try:
+        with shm.buf[:size] as buf:
+            return pickle.loads(buf)
+    finally:
+        shm.close()
+
+
+def debug_process_chunk(
+    bug_info: BugInfo, handles: List[DebugState | Tuple[str, int]]
+) -> List[Tuple[str | None, str | None]]:
+    """Debug a chunk of test cases, returns (test_name, error) for each one"""
+    results = []
+    for handle in handles:
+        try:
+            debug_state = load_debug_state(handle)
+            results.append((debug_process(bug_info, debug_state), None))
+        except Exception as e:
+            results.append((None, f"{type(e).__name__}: {e}"))
+    return results
 
 
 class DebugAgent:
     def __init__(self, bug_info: BugInfo):
         self.bug_info = bug_info
-        self.debug_states: Dict[int, DebugState] = {}
+        self.debug_states: List[DebugState] = []
         self.num_process = self.bug_info.config.hyper.debug_workers
 
         self.org = bug_info.config.search_model.org
@@ -95,24 +182,83 @@ class DebugAgent:
 
     def run_multiprocess(self):
         # Create a pool of processes
-        with Pool(processes=self.num_process) as pool:
+        with ProcessPoolExecutor(
+            max_workers=self.num_process,
+            initializer=init_debug_worker,
+            initargs=(self.bug_info,),
+        ) as executor:
             # Start the debug processes
-            async_results: List[AsyncResult] = []
-            for i, debug_state in self.debug_states.items():
-                result = pool.apply_async(
-                    debug_process,
-                    args=(self.bug_info, debug_state),
+            shm_blocks: List[SharedMemory] = []
+            handles = []
+            for debug_state in self.debug_states:
+                # the test code and the error message dominate the size of
+                # a state, only pickle the states which may be large
+                size_hint = len(debug_state.input.test_code) + len(
+                    debug_state.input.error_message
+                )
+                if size_hint > SHM_THRESHOLD:
+                    data = pickle.dumps(debug_state, pickle.HIGHEST_PROTOCOL)
+                    shm = SharedMemory(create=True, size=len(data))
+                    shm.buf[: len(data)] = data
+                    shm_blocks.append(shm)
+                    handles.append((shm.name, len(data)))
+                else:
+                    handles.append(debug_state)
+
+            # submit chunks of test cases to amortize the queue overhead
+            chunksize = max(1, len(handles) // (self.num_process * 4))
+            futures: List[Future] = []
+            report_progress = self.progress_reporter(len(handles))
+            for i in range(0, len(handles), chunksize):
+                future = executor.submit(
+                    debug_process_chunk,
+                    self.bug_info,
+                    handles[i : i + chunksize],
+                )
+                future.add_done_callback(report_progress)
+                futures.append(future)
+
+            # progress is reported by the callbacks, so we only need to
+            # block until all workers are finished
+            try:
+                wait(futures)
+            finally:
+                for shm in shm_blocks:
+                    shm.close()
+                    shm.unlink()
+
+    def progress_reporter(self, total: int):
+        """Create a future callback which logs errors and the progress.
+        The callback runs in the executor's management thread, so the
+        main thread is never blocked by reporting."""
+        lock = threading.Lock()
+        finished = 0
+
+        def _callback(future: Future):
+            nonlocal finished
+            if future.exception() is not None:
+                self.bug_info.logger.error(
+                    f"Error in subprocess: {future.exception()}"
+                )
+                return
+            for test_name, error in future.result():
+                with lock:
+                    finished += 1
+                    count = finished
+                if error is not None:
+                    self.bug_info.logger.error(
+                        f"Error in subprocess: {error}"
+                    )
+                    test_name = "failed"
+                self.bug_info.logger.info(
+                    f"{self.bug_info.bug_name}: {count}/{total} test cases finished ({test_name})"
                 )
-                async_results.append(result)
 
-            for r in async_results:
-                try:
-                    r.get()
-                except Exception as e:
-                    self.bug_info.logger.error(f"Error in subprocess: {e}")
+        return _callback
 
     def run_singleprocess(self):
-        for _, debug_state in self.debug_states.items():
+        init_debug_worker(self.bug_info)
+        for debug_state in self.debug_states:
             debug_process(self.bug_info, debug_state)
 
     def prepare_debug_inputs(
@@ -144,10 +290,6 @@ class DebugAgent:
             #     continue
             dataset_path = get_test_case_dataset_path(self.bug_info, test_case)
             repo_graph_file = dataset_path / "repograph.pkl"
-            with repo_graph_file.open("rb") as f:
-                repo_graph = pickle.load(f)
-            loaded_classes_file = dataset_path / "loaded_classes.txt"
-            loaded_classes = loaded_classes_file.read_text().split("\n")
 
             stack_trace_file = dataset_path / "stack_trace.txt"
             test_output_file = dataset_path / "test_output.txt"
@@ -172,8 +314,7 @@ class DebugAgent:
                     test_name=test_name,
                     test_code=test_code,
                     error_message=error_message,
-                    repo_graph=repo_graph,
-                    loaded_classes=loaded_classes,
+                    repo_graph_file=repo_graph_file,
                     output_path=output_path,
                 )
             )
@@ -183,7 +324,7 @@ class DebugAgent:
         debug_results = []
         for input in inputs:
             search_file = input.output_path / "search.json"
-            debug_report = json.loads(search_file.read_text())["debug_report"]
+            debug_report = load_json(search_file)["debug_report"]
 
             debug_results.append(
                 SINGLE_RESULT_TEMPLATE.format(
@@ -208,7 +349,7 @@ class DebugAgent:
                 raise Exception(
                     f"Search result file {search_file} is not found."
                 )
-            if not json.loads(search_file.read_text())["debug_report"]:
+            if not load_json(search_file)["debug_report"]:
                 raise Exception(
                     f"Search result file {search_file} does not contain debug report."
                 )
@@ -233,7 +374,7 @@ class DebugAgent:
             }
         )
 
-        result = None
+        suspicious_methods = None
         combined_graph_file = self.bug_info.bug_path / "combined_graph.pkl"
         with combined_graph_file.open("rb") as f:
             combined_graph = pickle.load(f)
@@ -249,15 +390,14 @@ class DebugAgent:
             message_text = self.llm_backend.get_msg_text(message)
 
             memory.add_message({"role": "assistant", "content": message_text})
-            result = extract_json_block(message_text)
-            if result is None:
+            suspicious_methods = extract_json_object(message_text)
+            if suspicious_methods is None:
                 error_message = f"Reponse format error, please return a JSON format verification result wrapped with ```json...``` block."
                 memory.add_message(
                     {"role": "user", "content": error_message}, "retry"
                 )
                 continue
 
-            suspicious_methods = json.loads(result)
             method_ids = [m["method_id"] for m in suspicious_methods]
             false_ids = []
             for method_id in method_ids:
@@ -289,7 +429,7 @@ class DebugAgent:
             "results": suspicious_methods,
             "memory": memory.serialize(),
         }
-        result_file.write_text(json.dumps(result_dict, indent=4))
+        dump_json(result_dict, result_file, indent=self.bug_info.json_indent)
 
     def get_debug_result(self):
         debug_result = {}
@@ -302,7 +442,7 @@ class DebugAgent:
             test_name = f"{test_class_name}::{test_method_name}"
             if test_name not in debug_result:
                 debug_result[test_name] = {}
-            search_result = json.loads(search_result_file.read_text())
+            search_result = load_json(search_result_file)
             for process_id in search_result:
                 debug_result[test_name][process_id] = {
                     "prediction": search_result[process_id]["memory"][
@@ -312,19 +452,21 @@ class DebugAgent:
                 }
 
         debug_result_file = self.bug_info.res_path / "debug_result.json"
-        debug_result_file.write_text(json.dumps(debug_result, indent=2))
+        dump_json(
+            debug_result, debug_result_file, indent=self.bug_info.json_indent
+        )
 
     def run(self, test_failure: TestFailure) -> List[Dict[str, Any]]:
         # Prepare the debug inputs
         inputs = self.prepare_debug_inputs(test_failure)
 
         # Create debug states and run the debug process
-        for i, debug_input in enumerate(inputs):
+        for debug_input in inputs:
             debug_state = DebugState(
                 bug_name=self.bug_info.bug_name,
                 input=debug_input,
             )
-            self.debug_states[i] = debug_state
+            self.debug_states.append(debug_state)
 
         if self.num_process > 1:
             self.run_multiprocess()
@@ -1,5 +1,4 @@
-import copy
-import json
+import functools
 from abc import ABC, abstractmethod
 from typing import Dict, List, Tuple
 
@@ -13,6 +12,8 @@ from openai.types.chat import (
 )
 from tenacity import retry, stop_after_attempt, wait_exponential
 
+from src.utils import loads_json
+
 
 def before_sleep_output(retry_state):
     print(f"\nRetry attempt {retry_state.attempt_number} failed.")
@@ -31,6 +32,10 @@ class LLMBackend(ABC):
     def call(self, **kwargs) -> ChatCompletion | Message:
         pass
 
+    @abstractmethod
+    async def acall(self, **kwargs) -> ChatCompletion | Message:
+        pass
+
     @staticmethod
     @abstractmethod
     def get_msg(msg: ChatCompletion | Message) -> str:
@@ -99,6 +104,24 @@ class OpenAIBackend(LLMBackend):
         response = self.client.chat.completions.create(**kwargs)
         return response
 
+    @functools.cached_property
+    def async_client(self) -> openai.AsyncOpenAI:
+        # created on first use so that it is bound to the running event loop
+        return openai.AsyncOpenAI(
+            api_key=self.api_key,
+            base_url=self.base_url,
+            timeout=60,
+        )
+
+    @retry(
+        stop=stop_after_attempt(3),
+        wait=wait_exponential(multiplier=1, min=4, max=10),
+        before_sleep=before_sleep_output,
+    )
+    async def acall(self, **kwargs) -> ChatCompletion:
+        response = await self.async_client.chat.completions.create(**kwargs)
+        return response
+
     @staticmethod
     def get_msg(response: ChatCompletion):
         return response.choices[0].message
@@ -123,9 +146,8 @@ class OpenAIBackend(LLMBackend):
     def get_single_tool_call_msg(
         msg: ChatCompletionMessage, index: int
     ) -> ChatCompletionMessage:
-        new_msg = copy.deepcopy(msg)
-        new_msg.tool_calls = [msg.tool_calls[index]]
-        return new_msg
+        # a shallow copy is enough since the messages are never modified
+        return msg.model_copy(update={"tool_calls": [msg.tool_calls[index]]})
 
     @staticmethod
     def get_tool_result_msg(
@@ -157,7 +179,7 @@ class OpenAIBackend(LLMBackend):
     def get_tool_args(
         tool_call: ChatCompletionMessageToolCall,
     ) -> Dict[str, str]:
-        return json.loads(tool_call.function.arguments)
+        return loads_json(tool_call.function.arguments)
 
 
 class AnthropicBackend(LLMBackend):
@@ -175,9 +197,60 @@ class AnthropicBackend(LLMBackend):
         before_sleep=before_sleep_output,
     )
     def call(self, **kwargs) -> ChatCompletion | Message:
-        response = self.client.messages.create(**kwargs)
+        response = self.client.messages.create(
+            **AnthropicBackend.add_cache_control(kwargs)
+        )
         return response
 
+    @functools.cached_property
+    def async_client(self) -> anthropic.AsyncAnthropic:
+        # created on first use so that it is bound to the running event loop
+        return anthropic.AsyncAnthropic(
+            api_key=self.api_key,
+            base_url=self.base_url,
+            timeout=60,
+        )
+
+    @retry(
+        stop=stop_after_attempt(3),
+        wait=wait_exponential(multiplier=1, min=4, max=10),
+        before_sleep=before_sleep_output,
+    )
+    async def acall(self, **kwargs) -> ChatCompletion | Message:
+        response = await self.async_client.messages.create(
+            **AnthropicBackend.add_cache_control(kwargs)
+        )
+        return response
+
+    @staticmethod
+    def add_cache_control(kwargs: Dict) -> Dict:
+        """
+        Mark the static system prompt and tool definitions as the cached prefix.
+        The system prompt is moved out of the messages as required by the API.
+        """
+        kwargs = dict(kwargs)
+        cache_control = {"type": "ephemeral"}
+        messages = kwargs.get("messages", [])
+        if (
+            messages
+            and isinstance(messages[0], dict)
+            and messages[0]["role"] == "system"
+        ):
+            kwargs["system"] = [
+                {
+                    "type": "text",
+                    "text": messages[0]["content"],
+                    "cache_control": cache_control,
+                }
+            ]
+            kwargs["messages"] = messages[1:]
+        tools = kwargs.get("tools")
+        if tools:
+            kwargs["tools"] = tools[:-1] + [
+                {**tools[-1], "cache_control": cache_control}
+            ]
+        return kwargs
+
     @staticmethod
     def get_msg(response: Message):
         return response
@@ -196,10 +269,9 @@ class AnthropicBackend(LLMBackend):
 
     @staticmethod
     def get_single_tool_call_msg(msg: Message, index: int) -> Message:
-        new_msg = copy.deepcopy(msg)
+        # a shallow copy is enough since the messages are never modified
         tool_calls = AnthropicBackend.get_tool_calls(msg)
-        new_msg.content = [tool_calls[index]]
-        return new_msg
+        return msg.model_copy(update={"content": [tool_calls[index]]})
 
     @staticmethod
     def get_tool_result_msg(
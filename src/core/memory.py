@@ -1,5 +1,7 @@
+import copy
+import functools
 import json
-from typing import Dict, List
+from typing import TYPE_CHECKING, Dict, List
 
 from anthropic.types import Message
 from openai.types.chat import ChatCompletionMessage
@@ -17,10 +19,29 @@ PRICE_PER_MILLION_TOKENS = {
 }
 
 
+if TYPE_CHECKING:
+    import tiktoken
+
+
+@functools.lru_cache(maxsize=8)
+def _enc_for(model_name: str) -> "tiktoken.Encoding":
+    # tiktoken is slow to import, only load it when tokens are counted
+    import tiktoken
+
+    try:
+        return tiktoken.encoding_for_model(model_name)
+    except KeyError:
+        # models from other providers are not registered in tiktoken
+        return tiktoken.get_encoding("o200k_base")
+
+
 class MyMessage:
     def __init__(self, llm_msg, type):
         self.llm_msg = llm_msg
         self.type = type
+        self.num_tokens = None
+        # compacted messages are kept for serialization but not sent to the LLM
+        self.compacted = False
 
     def dump(self):
         if isinstance(self.llm_msg, ChatCompletionMessage):
@@ -36,6 +57,13 @@ class MyMessage:
         else:
             return self.llm_msg
 
+    def text(self) -> str:
+        if hasattr(self.llm_msg, "model_dump_json"):
+            return self.llm_msg.model_dump_json()
+        if isinstance(self.llm_msg.get("content"), str):
+            return self.llm_msg["content"]
+        return json.dumps(self.dump(), default=str)
+
     def __hash__(self):
         return self.llm_msg.__hash__()
 
@@ -56,6 +84,21 @@ class Memory:
         if type == "retry":
             self.retry_msgs.append(my_msg)
 
+    def fork(self) -> "Memory":
+        """
+        Copy the memory for a new search path. The LLM messages are never
+        modified in place, so they are shared instead of deep copied.
+        """
+        memory = copy.copy(self)
+        # the wrappers carry per-path states (e.g. compacted), copy them
+        memory.messages = [copy.copy(msg) for msg in self.messages]
+        forked = {
+            id(old): new for old, new in zip(self.messages, memory.messages)
+        }
+        memory.retry_msgs = [forked[id(msg)] for msg in self.retry_msgs]
+        memory.costs = list(self.costs)
+        return memory
+
     def add_cost(self, completion_tokens: int, prompt_tokens: int):
         cost = self.in_tokens_cost(prompt_tokens) + self.out_tokens_cost(
             completion_tokens
@@ -68,17 +111,45 @@ class Memory:
             }
         )
 
-    def get_messages(self) -> List[Dict]:
+    def get_context_messages(self) -> List[MyMessage]:
         """
         Get all messages. To save cost, we remove previous retry messages
         except the last two retry messages (including question and the error message).
         """
-        messages = []
-        for msg in self.messages:
-            if len(self.retry_msgs) > 2 and msg in self.retry_msgs[:-2]:
-                continue
-            messages.append(msg.llm_msg)
-        return messages
+        # resolve the dropped retry messages once instead of per message
+        dropped = {id(msg) for msg in self.retry_msgs[:-2]}
+        return [
+            msg
+            for msg in self.messages
+            if not msg.compacted and id(msg) not in dropped
+        ]
+
+    def get_messages(self) -> List[Dict]:
+        return [msg.llm_msg for msg in self.get_context_messages()]
+
+    def get_token_count(self) -> int:
+        """Count the tokens of the messages that will be sent to the LLM"""
+        messages = self.get_context_messages()
+
+        # only encode the messages added since the last count
+        new_msgs = [msg for msg in messages if msg.num_tokens is None]
+        if new_msgs:
+            encoded = _enc_for(self.model_name).encode_ordinary_batch(
+                [msg.text() for msg in new_msgs]
+            )
+            for msg, tokens in zip(new_msgs, encoded):
+                msg.num_tokens = len(tokens)
+        return sum(msg.num_tokens for msg in messages)
+
+    def compact(self, summary: str, keep_first: int = 2):
+        """
+        Replace the context messages after the first `keep_first` ones
+        (by default the system prompt and the test failure information)
+        with a single summary message.
+        """
+        for msg in self.get_context_messages()[keep_first:]:
+            msg.compacted = True
+        self.add_message({"role": "user", "content": summary}, "summary")
 
     def get_debug_report(self) -> str:
         debug_report = ""
@@ -1,11 +1,7 @@
-import copy
-import json
-import threading
-import time
+import asyncio
 import traceback
-from concurrent.futures import Future, ThreadPoolExecutor
-from dataclasses import asdict, dataclass, field
-from typing import Dict, List
+from dataclasses import dataclass, field
+from typing import Dict, List, Tuple
 
 from anthropic.types import ToolUseBlock
 from openai.types.chat import ChatCompletionMessageToolCall
@@ -15,6 +11,8 @@ from src.core.llm_backend import AnthropicBackend, LLMBackend, OpenAIBackend
 from src.core.memory import Memory
 from src.core.prompt import (
     FAULT_LOCALIZATION_PROMPT_AUTOFL,
+    MEMORY_COMPACT_PROMPT,
+    MEMORY_SUMMARY_TEMPLATE,
     PINGFL_DEBUGGING_PROMPT,
     PINGFL_DEBUGGING_PROMPT_NO_THOUGHT,
     PINGFL_DEBUGGING_PROMPT_PARALLEL,
@@ -23,10 +21,13 @@ from src.core.prompt import (
     SEARCH_AGENT_USER_PROMPT,
     TOOLS_PINGFL_NO_ENHANCED,
 )
+from src.core.utils import PromptTemplate
 from src.core.verify_agent import VerifyAgent
 from src.repograph.graph_searcher import RepoSearcher
 from src.schema import SearchInput, Tag, VerifyInput
-from src.utils import Timer
+from src.utils import Timer, dump_json, load_json
+
+SEARCH_AGENT_USER_TEMPLATE = PromptTemplate(SEARCH_AGENT_USER_PROMPT)
 
 DEFAULT_FUNCTION = {
     "content": "First, let's look at all the classes covered by the failing test to understand the debugging scope.",
@@ -81,7 +82,12 @@ class ProcessState:
 
 class PingflAgent:
 
-    def __init__(self, bug_info: BugInfo, searcher: RepoSearcher):
+    def __init__(
+        self,
+        bug_info: BugInfo,
+        searcher: RepoSearcher,
+        verify_agent: VerifyAgent | None = None,
+    ):
         self.bug_info = bug_info
         self.searcher = searcher
 
@@ -90,6 +96,10 @@ class PingflAgent:
         self.cur_paths = 1
 
         self.max_tool_calls = bug_info.config.hyper.max_tool_calls
+        # compact the memory once the context exceeds this many tokens
+        self.memory_compact_tokens = getattr(
+            bug_info.config.hyper, "memory_compact_tokens", None
+        )
         self.max_verify_rounds = bug_info.config.hyper.max_verify_rounds
         if self.max_parallel > 1:
             self.debug_prompt = PINGFL_DEBUGGING_PROMPT_PARALLEL.format(
@@ -127,57 +137,56 @@ class PingflAgent:
         else:
             self.llm_backend = AnthropicBackend
             self.tool_set = SEARCH_AGENT_TOOLS_ANTHROPIC
+        # all search processes share one client and its connection pool
+        self.llm = self.llm_backend(
+            api_key=self.bug_info.config.search_model.api_key,
+            base_url=self.bug_info.config.search_model.base_url,
+        )
 
-        if hasattr(self.bug_info.config, "verify_model"):
+        self.verify_agent = verify_agent
+        if verify_agent is None and hasattr(
+            self.bug_info.config, "verify_model"
+        ):
             self.verify_agent = VerifyAgent(
                 bug_info=self.bug_info,
                 org=self.bug_info.config.verify_model.org,
             )
 
+        # all processes run as tasks on one event loop, so the shared
+        # states below are never accessed concurrently and need no lock
         self.processes: Dict[int, ProcessState] = {}
-        self.futures: List[Future] = []
+        self.tasks: Dict[int, asyncio.Task] = {}
         self.process_counter = 0
-        self.process_lock = threading.Lock()
+        # verify reports of the nominated methods, keyed by method id
+        self.verify_reports: Dict[str, str] = {}
         self.search_workers = bug_info.config.hyper.search_workers
-        self.thread_pool = ThreadPoolExecutor(
-            max_workers=self.search_workers,
-        )
-        self.futures = []
+        self.search_slots = asyncio.Semaphore(self.search_workers)
 
     def create_process(
         self, input: SearchInput, parent_id=None
     ) -> ProcessState:
-        with self.process_lock:
-            process_id = self.process_counter
-            if parent_id is not None:
-                parent_process = self.processes[parent_id]
-                self.processes[process_id] = ProcessState(
-                    input=input,
-                    llm=self.llm_backend(
-                        api_key=self.bug_info.config.search_model.api_key,
-                        base_url=self.bug_info.config.search_model.base_url,
-                    ),
-                    memory=copy.deepcopy(parent_process.memory),
-                    id=f"{parent_process.id}-{process_id}",
-                    function_calls=copy.deepcopy(
-                        parent_process.function_calls
-                    ),
-                )
-            else:
-                self.processes[process_id] = ProcessState(
-                    input=input,
-                    llm=self.llm_backend(
-                        api_key=self.bug_info.config.search_model.api_key,
-                        base_url=self.bug_info.config.search_model.base_url,
-                    ),
-                    memory=Memory(
-                        self.debug_prompt,
-                        self.bug_info.config.search_model.model,
-                    ),
-                    id=str(process_id),
-                )
-            self.process_counter += 1
-            return process_id
+        process_id = self.process_counter
+        if parent_id is not None:
+            parent_process = self.processes[parent_id]
+            self.processes[process_id] = ProcessState(
+                input=input,
+                llm=self.llm,
+                memory=parent_process.memory.fork(),
+                id=f"{parent_process.id}-{process_id}",
+                function_calls=parent_process.function_calls[:],
+            )
+        else:
+            self.processes[process_id] = ProcessState(
+                input=input,
+                llm=self.llm,
+                memory=Memory(
+                    self.debug_prompt,
+                    self.bug_info.config.search_model.model,
+                ),
+                id=str(process_id),
+            )
+        self.process_counter += 1
+        return process_id
 
     def save_memory(self):
         memory_cache = {}
@@ -188,13 +197,15 @@ class PingflAgent:
             }
         # save the memory cache to a file
         search_file = process.input.output_path / "search.json"
-        search_file.write_text(json.dumps(memory_cache, indent=2))
+        dump_json(
+            memory_cache, search_file, indent=self.bug_info.json_indent
+        )
         self.bug_info.logger.info(f"Save search memory cache to {search_file}")
 
     def load_memory(self, process: ProcessState):
         # load the memory cache from a file
         search_file = process.input.output_path / "search.json"
-        memory_cache = json.loads(search_file.read_text())
+        memory_cache = load_json(search_file)
         process_id = list(memory_cache.keys())[0]
 
         cached_messages = []
@@ -229,7 +240,7 @@ class PingflAgent:
         default_messages = [
             {
                 "role": "user",
-                "content": SEARCH_AGENT_USER_PROMPT.format(**asdict(input)),
+                "content": SEARCH_AGENT_USER_TEMPLATE.format(**vars(input)),
             },
             self.llm_backend.recover_msg(self.default_function),
             {
@@ -243,28 +254,36 @@ class PingflAgent:
 
         process.function_calls.append("get_covered_classes")
 
-    def run(self, input: SearchInput):
+    def start_process(
+        self, process_id: int, single_tool_call_msg=None, tool_args=None
+    ):
+        """Schedule a process, at most `search_workers` processes run at once"""
+
+        async def _run():
+            async with self.search_slots:
+                await self.run_process(
+                    process_id, single_tool_call_msg, tool_args
+                )
+
+        self.tasks[process_id] = asyncio.create_task(_run())
+
+    async def run(self, input: SearchInput):
         entry_process_id = self.create_process(input)
         self.init_memory(input, entry_process_id)
+        self.start_process(entry_process_id)
 
-        entry_future = self.thread_pool.submit(
-            self.run_process, entry_process_id
-        )
-        entry_future.process_id = entry_process_id
-        self.futures.append(entry_future)
-
-        # wait for all futures to finish
-        while not all(future.done() for future in self.futures):
-            time.sleep(1)
+        # wait for all tasks to finish, including the ones created meanwhile
+        while pending := [t for t in self.tasks.values() if not t.done()]:
+            await asyncio.wait(pending)
 
-        # check for exceptions in the futures
+        # check for exceptions in the tasks
         has_exception = False
-        for future in self.futures:
+        for process_id, task in self.tasks.items():
             try:
-                result = future.result()
+                result = task.result()
             except Exception as e:
                 self.bug_info.logger.error(
-                    f"<{self.processes[future.process_id].input.test_name}> - encountered an exception: {e}",
+                    f"<{self.processes[process_id].input.test_name}> - encountered an exception: {e}",
                     exc_info=True,
                 )
                 has_exception = True
@@ -275,19 +294,30 @@ class PingflAgent:
             )
         self.save_memory()
 
-    def execute_function(
+    async def execute_function(
         self,
         tool_call: ChatCompletionMessageToolCall | ToolUseBlock,
         process: ProcessState,
         message_text: str | None = None,
+        function_args: Dict | None = None,
     ):
-        function_args = self.llm_backend.get_tool_args(tool_call)
+        if function_args is None:
+            function_args = self.llm_backend.get_tool_args(tool_call)
         function_name = self.llm_backend.get_tool_name(tool_call)
         if function_name == "nominate_suspicious_method":
             method_id = function_args["method_id"]
             method_tag = self.searcher.get_method(method_id)
             if method_tag is None:
                 return self.searcher.get_method_code_for_id(method_id)
+            function_response = self.verify_reports.get(method_tag.method_id)
+            if function_response is not None:
+                # the method has been verified by another search path
+                self.bug_info.logger.info(
+                    f"{self.bug_info.bug_name} - <{process.input.test_name}> - Process {process.id} - reuse the verify report of {method_id}"
+                )
+                process.verify_rounds += 1
+                return function_response
+
             suspected_issue = message_text
             verify_input = self.get_verify_input(
                 process, suspected_issue, method_tag
@@ -297,14 +327,22 @@ class PingflAgent:
                 f"{self.bug_info.bug_name} - <{process.input.test_name}> - Process {process.id} - {method_id} nominated as suspicious",
             ):
                 try:
-                    function_response = self.verify_agent.run(verify_input)
+                    # print debugging blocks on test runs, keep it off the loop
+                    function_response = await asyncio.to_thread(
+                        self.verify_agent.run, verify_input
+                    )
                 except Exception as e:
                     traceback.print_exc()
                     return e.message
+            self.verify_reports[method_tag.method_id] = function_response
             process.verify_rounds += 1
         else:
+            # run graph lookups in a thread so the loop keeps serving the
+            # LLM calls of the other search processes meanwhile
             function_to_call = self.functions[function_name]
-            function_response = function_to_call(**function_args)
+            function_response = await asyncio.to_thread(
+                function_to_call, **function_args
+            )
         return function_response
 
     def get_verify_input(
@@ -316,7 +354,7 @@ class PingflAgent:
             error_message=process.input.error_message,
             method_id=method_tag.method_id,
             suspected_issue=suspected_issue,
-            method_code=method_tag.code,
+            method_code=self.searcher.get_method_code(method_tag),
             output_dir=process.input.output_path,
             process_id=process.id,
             method=method_tag,
@@ -329,46 +367,90 @@ class PingflAgent:
         message: ChatCompletionMessageToolCall | ToolUseBlock,
     ) -> None:
         tool_calls = self.llm_backend.get_tool_calls(message)
+        # parse the arguments once, they are reused when executing the call
+        tool_args = [self.parse_tool_args(t) for t in tool_calls]
+
+        # identical sibling calls would fork identical search paths
+        call_indexes = []
+        call_keys = set()
+        for i, tool_call in enumerate(tool_calls):
+            key = self.get_tool_call_key(tool_call, tool_args[i])
+            if key not in call_keys:
+                call_keys.add(key)
+                call_indexes.append(i)
 
         # check if reached the maximum number of search paths
-        with self.process_lock:
-            max_parallel = self.max_parallel
-            if self.cur_paths >= self.max_paths:
-                # do not create new processes
-                max_parallel = 1
-            else:
-                max_new_paths = min(len(tool_calls), self.max_parallel) - 1
-                max_parallel = (
-                    min(max_new_paths, self.max_paths - self.cur_paths) + 1
-                )
-            if max_parallel > 1:
-                self.cur_paths += max_parallel - 1
+        max_parallel = self.max_parallel
+        if self.cur_paths >= self.max_paths:
+            # do not create new processes
+            max_parallel = 1
+        else:
+            max_new_paths = min(len(call_indexes), self.max_parallel) - 1
+            max_parallel = (
+                min(max_new_paths, self.max_paths - self.cur_paths) + 1
+            )
+        if max_parallel > 1:
+            self.cur_paths += max_parallel - 1
 
-        for i in range(len(tool_calls[:max_parallel])):
+        for i in call_indexes[:max_parallel]:
             # create a new process for each tool call
             new_process_id = self.create_process(
-                input=copy.deepcopy(self.processes[process_id].input),
+                input=self.processes[process_id].input,
                 parent_id=process_id,
             )
             single_tool_call_message = (
                 self.llm_backend.get_single_tool_call_msg(message, i)
             )
-            future = self.thread_pool.submit(
-                self.run_process,
-                new_process_id,
-                single_tool_call_message,
+            self.start_process(
+                new_process_id, single_tool_call_message, tool_args[i]
             )
-            future.process_id = new_process_id
-            self.futures.append(future)
 
-        with self.process_lock:
-            # remove the parent process and its futures
-            self.processes.pop(process_id)
-            for future in self.futures:
-                if future.process_id == process_id:
-                    self.futures.remove(future)
+        # remove the parent process and its task
+        self.processes.pop(process_id)
+        self.tasks.pop(process_id, None)
+
+    def parse_tool_args(
+        self, tool_call: ChatCompletionMessageToolCall | ToolUseBlock
+    ) -> Dict | None:
+        """Parse the arguments of a tool call, None if they are malformed"""
+        try:
+            return self.llm_backend.get_tool_args(tool_call)
+        except ValueError:
+            # reported to the LLM when the call is executed
+            return None
+
+    def get_tool_call_key(
+        self,
+        tool_call: ChatCompletionMessageToolCall | ToolUseBlock,
+        tool_args: Dict | None,
+    ) -> Tuple:
+        """A canonical and hashable key of a tool call"""
+        name = self.llm_backend.get_tool_name(tool_call)
+        if tool_args is None:
+            # malformed calls are never considered identical
+            return (name, id(tool_call))
+        return (name, tuple(sorted((k, str(v)) for k, v in tool_args.items())))
+
+    async def compact_memory(self, process: ProcessState) -> None:
+        """Summarize the previous rounds to keep the context short"""
+        response = await process.llm.acall(
+            messages=process.memory.get_messages()
+            + [{"role": "user", "content": MEMORY_COMPACT_PROMPT}],
+            model=self.bug_info.config.search_model.model,
+            **self.bug_info.config.search_model.llm_args.asdict(),
+        )
+        message = self.llm_backend.get_msg(response)
+        summary = self.llm_backend.get_msg_text(message)
+        input_tokens, output_tokens = self.llm_backend.get_tokens(response)
+        process.memory.add_cost(output_tokens, input_tokens)
+        process.memory.compact(MEMORY_SUMMARY_TEMPLATE.format(summary=summary))
+        self.bug_info.logger.info(
+            f"{self.bug_info.bug_name} - <{process.input.test_name}> - Process {process.id} - compact memory to {process.memory.get_token_count()} tokens"
+        )
 
-    def run_process(self, process_id: str, single_tool_call_msg=None) -> None:
+    async def run_process(
+        self, process_id: str, single_tool_call_msg=None, tool_args=None
+    ) -> None:
         process = self.processes[process_id]
         message_text = None
 
@@ -383,8 +465,8 @@ class PingflAgent:
             )
 
             try:
-                tool_call_result = self.execute_function(
-                    tool_call, process, message_text
+                tool_call_result = await self.execute_function(
+                    tool_call, process, message_text, tool_args
                 )
                 process.function_calls.append(
                     self.llm_backend.get_tool_name(tool_call)
@@ -431,10 +513,17 @@ class PingflAgent:
                 f"{self.bug_info.bug_name} - <{process.input.test_name}> - Process {process.id} - reached max tool calls or verify rounds"
             )
         else:
+            if (
+                self.memory_compact_tokens
+                and process.memory.get_token_count()
+                > self.memory_compact_tokens
+            ):
+                await self.compact_memory(process)
+
             # get the next tool call
             messages = process.memory.get_messages()
             while True:
-                response = process.llm.call(
+                response = await process.llm.acall(
                     messages=messages,
                     tools=self.tool_set,
                     model=self.bug_info.config.search_model.model,
@@ -475,7 +564,7 @@ class PingflAgent:
                 "content": FAULT_LOCALIZATION_PROMPT_AUTOFL,
             }
             process.memory.add_message(fault_localization_message)
-            response = process.llm.call(
+            response = await process.llm.acall(
                 messages=process.memory.get_messages(),
                 model=self.bug_info.config.search_model.model,
                 **self.bug_info.config.search_model.llm_args.asdict(),
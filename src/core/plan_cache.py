@@ -0,0 +1,55 @@
+import hashlib
+import os
+import shutil
+from pathlib import Path
+from typing import Optional
+
+
+class PlanCache:
+    """
+    Exact-match cache of search results keyed by the failure signature.
+    Test cases of the same bug often fail with the same error at the same
+    place, so the search result of one test case can be reused by the others.
+    """
+
+    def __init__(self, cache_dir: Path, num_frames: int = 3):
+        self.cache_dir = cache_dir
+        self.num_frames = num_frames
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+
+    def get_signature(self, error_message: str) -> Optional[str]:
+        """
+        The first line of the error and the top stack frames, None if the
+        message has no stack frames, as the first line alone (e.g. a bare
+        `AssertionFailedError`) does not tell the failures apart.
+        """
+        lines = [line.strip() for line in error_message.splitlines()]
+        lines = [line for line in lines if line]
+        frames = [line for line in lines[1:] if line.startswith("at ")]
+        if not frames:
+            return None
+        return "\n".join([lines[0]] + frames[: self.num_frames])
+
+    def get_cache_file(self, error_message: str) -> Optional[Path]:
+        signature = self.get_signature(error_message)
+        if signature is None:
+            return None
+        key = hashlib.sha256(signature.encode("utf-8")).hexdigest()
+        return self.cache_dir / f"{key}.json"
+
+    def load(self, error_message: str, search_file: Path) -> Optional[Path]:
+        """Copy the cached search result to `search_file` if there is one"""
+        cache_file = self.get_cache_file(error_message)
+        if cache_file is None or not cache_file.exists():
+            return None
+        shutil.copyfile(cache_file, search_file)
+        return cache_file
+
+    def store(self, error_message: str, search_file: Path):
+        cache_file = self.get_cache_file(error_message)
+        if cache_file is None:
+            return
+        # other workers may read the cache at the same time
+        tmp_file = cache_file.with_suffix(f".{os.getpid()}.tmp")
+        shutil.copyfile(search_file, tmp_file)
+        os.replace(tmp_file, cache_file)
@@ -794,6 +794,13 @@ NOTE:
 
 PINGFL_SUMMARIZATION_PROMPT = """Based on the available information, provide a step-by-step explanation of how the bug occurred."""
 
+MEMORY_COMPACT_PROMPT = """Summarize the debugging process so far in a few paragraphs. Keep the classes and method IDs you have inspected, the key observations about their code, the verification results of nominated methods, and your current hypothesis about the root cause. Do not call any function."""
+
+MEMORY_SUMMARY_TEMPLATE = """Here is a summary of the debugging process so far:
+{summary}
+
+Please continue debugging."""
+
 PINGFL_DEBUGGING_PROMPT = """
 You are a Software Debugging Assistant. You will be provided with the test failure information and a set of callable functions to help you debug the issue. Your task is to understand the root cause of the bug step-by-step using the callable functions.
 
@@ -1,75 +1,114 @@
+import json
 import re
+from json.decoder import WHITESPACE
+from string import Formatter
 from typing import List, Tuple
 
+# patterns are compiled once at import time, the extractors are called on
+# every LLM response
+SEARCH_REPLACE_PATTERN = re.compile(
+    r"<+ SEARCH\n(.*?)\n=+\n(.*?)\n>+ REPLACE", re.DOTALL
+)
+EXISTING_CODE_PATTERN = re.compile(
+    r"// \.\.\. existing code \.\.\.\n(.*?)\n// \.\.\. existing code \.\.\.",
+    re.DOTALL,
+)
+DIFF_BLOCK_PATTERN = re.compile(r"```diff\n(.*?)\n```", re.DOTALL)
+JAVA_BLOCK_PATTERN = re.compile(r"```java\n(.*?)\n```", re.DOTALL)
+EDIT_BLOCK_PATTERN = re.compile(r"```edit\n(.*?)\n```", re.DOTALL)
+PRINT_PATTERN = re.compile(r"(System\.out\.println\((.*?)\);)", re.DOTALL)
+PREFIX_PATTERN = re.compile(
+    r"// PREFIX_START\n(.*?)\n// PREFIX_END", re.DOTALL
+)
+SUFFIX_PATTERN = re.compile(
+    r"// SUFFIX_START\n(.*?)\n// SUFFIX_END", re.DOTALL
+)
+REPLACE_PATTERN = re.compile(
+    r"// PREFIX_END\n(.*?)\n// SUFFIX_START", re.DOTALL
+)
+
+
+class PromptTemplate:
+    """A `str.format` style prompt template which is parsed only once"""
+
+    def __init__(self, template: str):
+        self.template = template
+        self.parsed = tuple(
+            (literal, field)
+            for literal, field, _, _ in Formatter().parse(template)
+        )
+
+    def format(self, **kwargs) -> str:
+        return "".join(
+            literal if field is None else literal + str(kwargs[field])
+            for literal, field in self.parsed
+        )
+
 
 def extract_search_replace_block(text):
-    pattern = r"<+ SEARCH\n(.*?)\n=+\n(.*?)\n>+ REPLACE"
-    matche = re.search(pattern, text, re.DOTALL)
+    matche = SEARCH_REPLACE_PATTERN.search(text)
     if matche:
         return (matche.group(1), matche.group(2))
     return None
 
 
 def extract_edit_block(text):
-    pattern = r"// \.\.\. existing code \.\.\.\n(.*?)\n// \.\.\. existing code \.\.\."
-    match = re.search(pattern, text, re.DOTALL)
+    match = EXISTING_CODE_PATTERN.search(text)
     if match:
         return match.group(1)
     return None
 
 
 def extract_diff_block(text):
-    pattern = r"```diff\n(.*?)\n```"
-    match = re.search(pattern, text, re.DOTALL)
+    match = DIFF_BLOCK_PATTERN.search(text)
     if match:
         return match.group(1)
     return None
 
 
-def extract_json_block(text):
-    pattern = r"```json\n(.*?)\n```"
-    matches = re.search(pattern, text, re.DOTALL)
-    if matches:
-        return matches.group(1)
+def extract_json_object(text: str):
+    """
+    Parse the first valid ```json block in place with a single scan,
+    returns None if there is no such block.
+    """
+    decoder = json.JSONDecoder()
+    start = text.find("```json")
+    while start != -1:
+        # raw_decode does not skip the leading whitespaces
+        start = WHITESPACE.match(text, start + len("```json")).end()
+        try:
+            return decoder.raw_decode(text, start)[0]
+        except json.JSONDecodeError:
+            start = text.find("```json", start)
     return None
 
 
 def extract_java_block(text):
-    pattern = r"```java\n(.*?)\n```"
-    match = re.search(pattern, text, re.DOTALL)
+    match = JAVA_BLOCK_PATTERN.search(text)
     if match:
         return match.group(1)
     return None
 
 
 def extract_edit_block(text):
-    pattern = r"```edit\n(.*?)\n```"
-    match = re.search(pattern, text, re.DOTALL)
+    match = EDIT_BLOCK_PATTERN.search(text)
     if match:
         return match.group(1)
     return None
 
 
 def extract_print_blocks(text) -> List[Tuple[str, str]]:
-    pattern = r"(System\.out\.println\((.*?)\);)"
-    matches = re.findall(pattern, text, re.DOTALL)
-    return matches
+    return PRINT_PATTERN.findall(text)
 
 
 def remove_whitespace(lines: List[str]):
-    new_text_lines = []
-    for line in lines:
-        new_text_lines.append(line.strip())
-    return "\n".join(new_text_lines)
+    return "\n".join(line.strip() for line in lines)
 
 
 def extract_replace_lines(text: str):
-    prefix_pattern = r"// PREFIX_START\n(.*?)\n// PREFIX_END"
-    suffix_pattern = r"// SUFFIX_START\n(.*?)\n// SUFFIX_END"
-    replace_pattern = r"// PREFIX_END\n(.*?)\n// SUFFIX_START"
-    prefix_match = re.search(prefix_pattern, text, re.DOTALL)
-    suffix_match = re.search(suffix_pattern, text, re.DOTALL)
-    replace_match = re.search(replace_pattern, text, re.DOTALL)
+    prefix_match = PREFIX_PATTERN.search(text)
+    suffix_match = SUFFIX_PATTERN.search(text)
+    replace_match = REPLACE_PATTERN.search(text)
     if prefix_match and suffix_match and replace_match:
         return (
             prefix_match.group(1),
@@ -1,6 +1,5 @@
-import json
 import shutil
-from dataclasses import asdict, dataclass
+from dataclasses import dataclass
 from pathlib import Path
 
 from src.config import BugInfo
@@ -21,6 +20,7 @@ from src.core.prompt_ablation import (
 )
 from src.core.utils import (
     ContextMatcher,
+    PromptTemplate,
     extract_edit_block,
     extract_java_block,
     extract_print_blocks,
@@ -34,6 +34,7 @@ from src.exceptions import (
 )
 from src.interfaces.d4j import check_out_playground, run_single_test_playground
 from src.schema import VerifyInput
+from src.utils import dump_json
 
 
 @dataclass
@@ -76,6 +77,16 @@ class VerifyAgent:
                 self.user_prompt = VERIFY_AGENT_USER_PROMPT_NO_TEST_OUTPUT
             elif bug_info.config.ablation.stack_trace:
                 self.user_prompt = VERIFY_AGENT_USER_PROMPT_NO_STACK_TRACE
+        self.user_prompt = PromptTemplate(self.user_prompt)
+        self.system_prompt = self.prompt.format(
+            max_edit_count=self.max_edit_count
+        )
+        # the client is thread-safe, so all verifications share one
+        # connection pool instead of building a new client each time
+        self.llm = self.llm_backend(
+            api_key=self.bug_info.config.verify_model.api_key,
+            base_url=self.bug_info.config.verify_model.base_url,
+        )
 
     def run(self, input: VerifyInput) -> Memory:
         process: ProcessState = self.create_process(input)
@@ -94,18 +105,17 @@ class VerifyAgent:
             "memory": process.memory.serialize(),
             "print_debugging_report": process.memory.get_debug_report(),
         }
-        verify_file.write_text(json.dumps(memory_cache, indent=2))
+        dump_json(
+            memory_cache, verify_file, indent=self.bug_info.json_indent
+        )
         self.bug_info.logger.info(f"Save debug memory cache to {verify_file}")
 
     def create_process(self, input: VerifyInput) -> ProcessState:
         process = ProcessState(
             verify_input=input,
-            llm=self.llm_backend(
-                api_key=self.bug_info.config.verify_model.api_key,
-                base_url=self.bug_info.config.verify_model.base_url,
-            ),
+            llm=self.llm,
             memory=Memory(
-                self.prompt.format(max_edit_count=self.max_edit_count),
+                self.system_prompt,
                 model_name=self.bug_info.config.verify_model.model,
             ),
         )
@@ -113,7 +123,7 @@ class VerifyAgent:
         # initial message
         user_message = {
             "role": "user",
-            "content": self.user_prompt.format(**asdict(input)),
+            "content": self.user_prompt.format(**vars(input)),
         }
         process.memory.add_message(user_message)
         return process
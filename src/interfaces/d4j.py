@@ -12,7 +12,6 @@ from typing import Dict, List, Optional
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from interfaces.method_extractor import JavaMethodExtractor, JMethod
 from interfaces.utils import (
-    WorkDir,
     auto_read,
     filter_compile_error,
     git_clean,
@@ -84,25 +83,29 @@ class JavaClass:
 
 
 def check_out(bugInfo: BugInfo):
-    with WorkDir(bugInfo.proj_tmp_path):
-        if not bugInfo.buggy_path.exists():
-            run_cmd(
-                f"{bugInfo.bug_exec} checkout -p {bugInfo.project} -v {bugInfo.bug_id}b -w buggy"
-            )
-        if not bugInfo.fixed_path.exists():
-            run_cmd(
-                f"{bugInfo.bug_exec} checkout -p {bugInfo.project} -v {bugInfo.bug_id}f -w fixed"
-            )
+    work_dir = bugInfo.proj_tmp_path
+    work_dir.mkdir(parents=True, exist_ok=True)
+    if not bugInfo.buggy_path.exists():
+        run_cmd(
+            f"{bugInfo.bug_exec} checkout -p {bugInfo.project} -v {bugInfo.bug_id}b -w buggy",
+            cwd=work_dir,
+        )
+    if not bugInfo.fixed_path.exists():
+        run_cmd(
+            f"{bugInfo.bug_exec} checkout -p {bugInfo.project} -v {bugInfo.bug_id}f -w fixed",
+            cwd=work_dir,
+        )
 
 
 def check_out_playground(bugInfo: BugInfo, playground_path: Path):
     parent_path = playground_path.parent
     dirname = playground_path.name
-    with WorkDir(parent_path):
-        if not playground_path.exists():
-            run_cmd(
-                f"{bugInfo.bug_exec} checkout -p {bugInfo.project} -v {bugInfo.bug_id}b -w {dirname}"
-            )
+    parent_path.mkdir(parents=True, exist_ok=True)
+    if not playground_path.exists():
+        run_cmd(
+            f"{bugInfo.bug_exec} checkout -p {bugInfo.project} -v {bugInfo.bug_id}b -w {dirname}",
+            cwd=parent_path,
+        )
 
 
 def run_single_test_playground(
@@ -248,14 +251,9 @@ def run_test_with_instrument(test_case: TestCase, bugInfo: BugInfo):
             f"srcClassPath={src_class_path},"
             f"testClassPath={test_class_path}"
         )
-        with WorkDir(bugInfo.buggy_path):
-            run_cmd(cmd)
-            shutil.copy(
-                f"{bugInfo.buggy_path}/callgraph.graphml", test_cache_dir
-            )
-            shutil.copy(
-                f"{bugInfo.buggy_path}/loaded_classes.txt", test_cache_dir
-            )
+        run_cmd(cmd, cwd=bugInfo.buggy_path)
+        shutil.copy(f"{bugInfo.buggy_path}/callgraph.graphml", test_cache_dir)
+        shutil.copy(f"{bugInfo.buggy_path}/loaded_classes.txt", test_cache_dir)
         test_report_file = bugInfo.buggy_path / "failing_tests"
         test_report = test_report_file.read_text().splitlines()
         test_output, stack_trace = parse_test_report(test_report, bugInfo)
@@ -449,7 +447,7 @@ def get_failed_tests(bugInfo: BugInfo) -> TestFailure:
     )
 
     with open(bugInfo.test_failure_file, "wb") as f:
-        pickle.dump(test_failure, f)
+        pickle.dump(test_failure, f, pickle.HIGHEST_PROTOCOL)
         bugInfo.logger.info(
             f"[get test failure object] Save failed tests to {bugInfo.test_failure_file}"
         )
@@ -530,7 +528,9 @@ def filter_classes_Ochiai(
     # filter out useless classes and methods
     for javaclass in extracted_classes:
         if javaclass.class_name in bug_result_dict:
-            new_javaclass = copy.deepcopy(javaclass)
+            # only the methods dict is changed, the methods are shared
+            new_javaclass = copy.copy(javaclass)
+            new_javaclass.methods = dict(javaclass.methods)
             for inst_id in javaclass.methods:
                 inst_method_name = inst_id.split("::")[1].split("(")[0]
                 if (
@@ -568,7 +568,9 @@ def filter_classes_Grace(
     # filter out useless classes and methods
     for javaclass in extracted_classes:
         if javaclass.class_name in bug_result_dict:
-            new_javaclass = copy.deepcopy(javaclass)
+            # only the methods dict is changed, the methods are shared
+            new_javaclass = copy.copy(javaclass)
+            new_javaclass.methods = dict(javaclass.methods)
             for inst_id in javaclass.methods:
                 inst_method_name = inst_id.split("::")[1].split("(")[0]
                 if (
@@ -624,12 +626,8 @@ def get_class_name_from_msg(tmp_path, test_class):
         with open(stack_trace_file, "r") as f:
             stack_trace = f.read()
         matches = re.findall(r"\b(?:\w*\.)+[A-Z]\w*", stack_trace)
-        matches = list(set(matches))
-        candidates = []
-        for match in matches:
-            candidates.extend(get_target_classes(match))
-        for candidate in candidates:
-            extra_class_names.add(candidate)
+        for match in set(matches):
+            extra_class_names.update(get_target_classes(match))
     return list(extra_class_names)
 
 
@@ -1,18 +1,23 @@
 import os
 import re
+import shlex
 import subprocess as sp
 
-import chardet
+from chardet.universaldetector import UniversalDetector
 
 
-def run_cmd(cmd: str, debug=False):
+def run_cmd(cmd: str, debug=False, cwd=None):
     if debug:
         print("-" * 50)
         print(f"run command: {cmd}")
-    p = sp.Popen(cmd.split(" "), stdin=sp.PIPE, stdout=sp.PIPE, stderr=sp.PIPE)
-    output, err = p.communicate()
-    out = output.decode("utf-8")
-    err = err.decode("utf-8")
+    p = sp.run(
+        shlex.split(cmd),
+        stdin=sp.DEVNULL,
+        capture_output=True,
+        encoding="utf-8",
+        cwd=cwd,
+    )
+    out, err = p.stdout, p.stderr
     if debug:
         print(err)
         print(out)
@@ -21,10 +26,7 @@ def run_cmd(cmd: str, debug=False):
 
 
 def git_clean(git_dir):
-    cwd = os.getcwd()
-    os.chdir(git_dir)
-    run_cmd("git clean -df")
-    os.chdir(cwd)
+    run_cmd("git clean -df", cwd=git_dir)
 
 
 def clean_doc(doc: str) -> str:
@@ -43,11 +45,20 @@ def clean_doc(doc: str) -> str:
 
 
 def auto_read(file):
+    # detect the encoding from the leading chunks only, instead of holding
+    # the raw bytes and the decoded text of the whole file at once
+    detector = UniversalDetector()
     with open(file, "rb") as f:
-        content = f.read()
-    detected_encoding = chardet.detect(content)["encoding"]
-    text = content.decode(detected_encoding, errors="ignore")
-    return text
+        for chunk in iter(lambda: f.read(8192), b""):
+            detector.feed(chunk)
+            if detector.done:
+                break
+    detector.close()
+    detected_encoding = detector.result["encoding"] or "utf-8"
+    with open(
+        file, "r", encoding=detected_encoding, errors="ignore", newline=""
+    ) as f:
+        return f.read()
 
 
 def filter_compile_error(log: str) -> str:
@@ -83,6 +94,11 @@ def filter_compile_error(log: str) -> str:
 
 
 class WorkDir:
+    """
+    Change the working directory of the whole process, prefer passing
+    `cwd` to `run_cmd` which is safe to use from multiple threads.
+    """
+
     def __init__(self, path):
         self.work_dir = path
         self.cwd = os.getcwd()
@@ -95,7 +111,6 @@ class WorkDir:
 
     def __exit__(self, exc_type, exc_value, traceback):
         os.chdir(self.cwd)
-        return True
 
 
 if __name__ == "__main__":
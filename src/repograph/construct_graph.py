@@ -12,6 +12,7 @@ from tree_sitter_languages import get_language, get_parser
 
 from src.config import BugInfo
 from src.interfaces.d4j import get_test_case_dataset_path
+from src.repograph.graph_arrays import save_undirected_graphs
 from src.schema import CGMethodNode, Tag, TestFailure
 from src.utils import Timer
 
@@ -104,16 +105,21 @@ class CodeGraph:
             Note that their may be self loops in the call graph"""
             visited_fathers.add(node)
             matched_successors = []
-            for successor in inst_graph.successors(node):
-                if successor in visited_fathers:
-                    continue
-                if successor in node_to_tag:
-                    matched_successors.append(node_to_tag[successor])
+            # iterative DFS, the unmatched call chains can be deeper than
+            # the recursion limit
+            stack = [iter(inst_graph.successors(node))]
+            while stack:
+                for successor in stack[-1]:
+                    if successor in visited_fathers:
+                        continue
+                    if successor in node_to_tag:
+                        matched_successors.append(node_to_tag[successor])
+                    else:
+                        visited_fathers.add(successor)
+                        stack.append(iter(inst_graph.successors(successor)))
+                        break
                 else:
-                    matched = get_all_matched_successors(
-                        successor, visited_fathers
-                    )
-                    matched_successors.extend(matched)
+                    stack.pop()
 
             return matched_successors
 
@@ -596,7 +602,7 @@ def create_repo_graph(
             bug_info.logger.info(f"[build repo graph] OK!")
             all_graphs.append(G)
             with repo_graph_file.open("wb") as f:
-                pickle.dump(G, f)
+                pickle.dump(G, f, pickle.HIGHEST_PROTOCOL)
 
     combined_graph_file = bug_info.bug_path / "combined_graph.pkl"
     if combined_graph_file.exists():
@@ -606,5 +612,8 @@ def create_repo_graph(
         return
     combined_graph = nx.compose_all(all_graphs)
     with combined_graph_file.open("wb") as f:
-        pickle.dump(combined_graph, f)
+        pickle.dump(combined_graph, f, pickle.HIGHEST_PROTOCOL)
+    save_undirected_graphs(
+        combined_graph, bug_info.bug_path / "combined_graph.npz"
+    )
     bug_info.logger.info(f"[build combined graph] OK!")
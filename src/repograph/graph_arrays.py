@@ -0,0 +1,116 @@
+import functools
+import pickle
+from pathlib import Path
+from typing import TYPE_CHECKING, Callable, Dict, List, Tuple
+
+import numpy as np
+from scipy.sparse import csr_matrix
+
+from src.schema import Tag
+
+if TYPE_CHECKING:
+    import networkx as nx
+
+# node ids, the undirected dynamic (call) graph and the undirected
+# combined graph, both graphs are CSR matrices over the node ids
+UndirectedGraphs = Tuple[Dict[Tag, int], csr_matrix, csr_matrix]
+
+
+def to_undirected_csr(edges: List[Tuple[int, int]], num_nodes: int):
+    edges = np.array(edges, dtype=np.int32).reshape(-1, 2)
+    weights = np.ones(len(edges))
+    # the matrix is directed, csgraph treats it as undirected on request
+    return csr_matrix(
+        (weights, (edges[:, 0], edges[:, 1])), shape=(num_nodes, num_nodes)
+    )
+
+
+def get_undirected_graphs(graph: "nx.MultiDiGraph") -> UndirectedGraphs:
+    """
+    Collapse the repo graph into the undirected dynamic (call) graph and
+    the undirected combined graph, stored as CSR matrices over integer node
+    ids. Both only depend on the repo graph, so build them once and reuse
+    them for all distance queries.
+    """
+    node_ids = {node: i for i, node in enumerate(graph.nodes)}
+    dynamic_edges = []
+    combined_edges = []
+    # walk the raw adjacency dicts, edges(data=True) builds a tuple per edge
+    for u, neighbors in graph._adj.items():
+        u_id = node_ids[u]
+        for v, edges in neighbors.items():
+            ids = (u_id, node_ids[v])
+            combined_edges.append(ids)
+            if any(data["rel"] == "calls" for data in edges.values()):
+                dynamic_edges.append(ids)
+    return (
+        node_ids,
+        to_undirected_csr(dynamic_edges, len(node_ids)),
+        to_undirected_csr(combined_edges, len(node_ids)),
+    )
+
+
+def save_undirected_graphs(graph: "nx.MultiDiGraph", npz_file: Path):
+    """
+    Save the nodes and the CSR arrays of the undirected graphs, so that the
+    evaluation does not need to unpickle and convert the networkx graph.
+    """
+    node_ids, dynamic_graph, combined_graph = get_undirected_graphs(graph)
+    nodes = np.empty(len(node_ids), dtype=object)
+    nodes[:] = list(node_ids)
+    np.savez_compressed(
+        npz_file,
+        nodes=nodes,
+        dynamic_indptr=dynamic_graph.indptr,
+        dynamic_indices=dynamic_graph.indices,
+        combined_indptr=combined_graph.indptr,
+        combined_indices=combined_graph.indices,
+    )
+
+
+def read_undirected_graphs(npz_file: Path, nodes: List[Tag]):
+    """Read the CSR arrays saved by `save_undirected_graphs`"""
+    shape = (len(nodes), len(nodes))
+    graphs = []
+    with np.load(npz_file) as data:
+        for name in ["dynamic", "combined"]:
+            indices = data[f"{name}_indices"]
+            indptr = data[f"{name}_indptr"]
+            weights = np.ones(len(indices))
+            graphs.append(csr_matrix((weights, indices, indptr), shape=shape))
+    node_ids = {node: i for i, node in enumerate(nodes)}
+    return (node_ids, *graphs)
+
+
+def load_graph_nodes(
+    bug_path: Path,
+) -> Tuple[List[Tag], Callable[[], UndirectedGraphs]]:
+    """
+    Load the nodes of a bug, from `combined_graph.npz` if it exists, else
+    from `combined_graph.pkl`. The undirected graphs are only read or built
+    when the returned function is first called.
+    """
+    npz_file = bug_path / "combined_graph.npz"
+    if not npz_file.exists():
+        with (bug_path / "combined_graph.pkl").open("rb") as f:
+            graph = pickle.load(f)
+        nodes = list(graph.nodes)
+        get_graphs = functools.partial(get_undirected_graphs, graph)
+    else:
+        # the nodes are Tag objects which are stored with pickle, the
+        # arrays of an npz file are only read on access
+        with np.load(npz_file, allow_pickle=True) as data:
+            nodes = data["nodes"].tolist()
+        get_graphs = functools.partial(read_undirected_graphs, npz_file, nodes)
+    return nodes, functools.lru_cache(maxsize=None)(get_graphs)
+
+
+def load_undirected_graphs(
+    bug_path: Path,
+) -> Tuple[List[Tag], UndirectedGraphs]:
+    """
+    Load the nodes and the undirected graphs of a bug, from
+    `combined_graph.npz` if it exists, else from `combined_graph.pkl`.
+    """
+    nodes, get_graphs = load_graph_nodes(bug_path)
+    return nodes, get_graphs()
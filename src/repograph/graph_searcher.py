@@ -1,8 +1,12 @@
+import dataclasses
+import functools
 import json
+import os
+import pickle
+import sqlite3
 from difflib import SequenceMatcher
-from typing import Dict, List
-
-import networkx as nx
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Dict, List, Tuple
 
 from src.exceptions import (
     ClassNameNotFoundError,
@@ -13,9 +17,12 @@ from src.exceptions import (
 )
 from src.schema import Tag
 
+if TYPE_CHECKING:
+    import networkx as nx
+
 
 class AutoFLRepoSearcher:
-    def __init__(self, graph: nx.MultiDiGraph):
+    def __init__(self, graph: "nx.MultiDiGraph"):
         self.graph = graph
         self.covered_classes_result = None
 
@@ -197,10 +204,84 @@ class AutoFLRepoSearcher:
         return result
 
 
+class CodelessPickler(pickle.Pickler):
+    """Pickle tags without their code, which is kept in a separate store"""
+
+    def reducer_override(self, obj):
+        if type(obj) is Tag:
+            return dataclasses.replace(obj, code=None).__reduce__()
+        return NotImplemented
+
+
 class RepoSearcher:
-    def __init__(self, graph: nx.MultiDiGraph):
+    # the attributes derived from the graph, they are all a `freeze` keeps
+    INDEX_ATTRS = (
+        "method_nodes",
+        "method_dict",
+        "covered_method_dict",
+        "method_id_map",
+    )
+
+    def __init__(self, graph: "nx.MultiDiGraph"):
         self.graph = graph
         self.covered_classes_result = None
+        self.code_file = None
+        self.code_db = None
+        self.__dict__.update(self.index_methods(graph))
+        self.memoize_tools()
+
+    @classmethod
+    def thaw(cls, frozen_file: Path) -> "RepoSearcher":
+        """
+        Create a searcher from the method indexes saved by `freeze`, the
+        method code is read from the code store when it is asked for.
+        """
+        searcher = cls.__new__(cls)
+        searcher.graph = None
+        searcher.covered_classes_result = None
+        searcher.code_file = frozen_file.with_suffix(".code.sqlite")
+        searcher.code_db = None
+        with frozen_file.open("rb") as f:
+            searcher.__dict__.update(pickle.load(f))
+        searcher.memoize_tools()
+        return searcher
+
+    def freeze(self, frozen_file: Path):
+        """
+        Save the method nodes and their indexes only, which is much smaller
+        and faster to load than the whole repo graph with all its edges.
+        The method code goes to a SQLite store next to it, most methods are
+        never looked at during a search.
+        """
+        # write to temporary files first, other workers may read them
+        tmp_suffix = f".{os.getpid()}.tmp"
+        code_file = frozen_file.with_suffix(".code.sqlite")
+        tmp_file = code_file.with_suffix(tmp_suffix)
+        tmp_file.unlink(missing_ok=True)
+        with sqlite3.connect(tmp_file) as code_db:
+            code_db.execute(
+                "CREATE TABLE method (method_id TEXT PRIMARY KEY, code TEXT)"
+            )
+            code_db.executemany(
+                "INSERT OR REPLACE INTO method VALUES (?, ?)",
+                ((m.method_id, m.code) for m in self.method_nodes),
+            )
+        code_db.close()
+        os.replace(tmp_file, code_file)
+
+        # the nodes in the indexes are pickled once and shared by reference
+        index = {name: getattr(self, name) for name in self.INDEX_ATTRS}
+        tmp_file = frozen_file.with_suffix(tmp_suffix)
+        with tmp_file.open("wb") as f:
+            CodelessPickler(f, pickle.HIGHEST_PROTOCOL).dump(index)
+        os.replace(tmp_file, frozen_file)
+
+    @staticmethod
+    def index_methods(graph: "nx.MultiDiGraph") -> Dict[str, Any]:
+        # only the method nodes are searched, the edges are never used
+        method_nodes: List[Tag] = [
+            node for node in graph.nodes if node.category == "function"
+        ]
 
         # create a dictionary of methods grouped by class name
         # note that this supports fuzzy matching
@@ -210,80 +291,88 @@ class RepoSearcher:
         # create a map of method ID to method node
         method_id_map: Dict[str, Tag] = {}
 
-        for node in self.graph.nodes(data=True):
-            if node[0].category == "function":
-                method_node: Tag = node[0]
-
-                method_id_map[method_node.method_id] = method_node
-                inner_class_names = []
-                if method_node.inner_class:
-                    inner_class_names = method_node.inner_class.split("$")
-                class_names = [method_node.outer_class] + inner_class_names
-                for i in range(1, len(class_names) + 1):
-                    class_name = ".".join(class_names[:i])
-                    class_full_name = f"{method_node.pkg_name}.{class_name}"
+        for method_node in method_nodes:
+            method_id_map[method_node.method_id] = method_node
+            inner_class_names = []
+            if method_node.inner_class:
+                inner_class_names = method_node.inner_class.split("$")
+            class_names = [method_node.outer_class] + inner_class_names
+            for i in range(1, len(class_names) + 1):
+                class_name = ".".join(class_names[:i])
+                class_full_name = f"{method_node.pkg_name}.{class_name}"
+                try:
+                    method_dict[class_full_name].append(method_node)
+                except KeyError:
+                    method_dict[class_full_name] = [method_node]
+                if method_node.is_covered:
                     try:
-                        method_dict[class_full_name].append(method_node)
+                        covered_method_dict[class_full_name].append(
+                            method_node
+                        )
                     except KeyError:
-                        method_dict[class_full_name] = [method_node]
-                    if method_node.is_covered:
-                        try:
-                            covered_method_dict[class_full_name].append(
-                                method_node
-                            )
-                        except KeyError:
-                            covered_method_dict[class_full_name] = [
-                                method_node
-                            ]
-        self.method_dict = method_dict
-        self.method_id_map = method_id_map
-        self.covered_method_dict = covered_method_dict
+                        covered_method_dict[class_full_name] = [method_node]
+        return {
+            "method_nodes": method_nodes,
+            "method_dict": method_dict,
+            "covered_method_dict": covered_method_dict,
+            "method_id_map": method_id_map,
+        }
+
+    def memoize_tools(self):
+        # the graph never changes, so the lookups called as tools by the
+        # search processes are memoized per searcher
+        for name in (
+            "get_covered_method_ids_for_class",
+            "get_method_code_for_id",
+            "get_possible_classes",
+            "search_covered_class_full_name",
+            "search_covered_method_id",
+        ):
+            method = getattr(self, name)
+            setattr(self, name, functools.lru_cache(maxsize=None)(method))
 
     def get_method(self, method_id) -> Tag | None:
         return self.method_id_map.get(method_id, None)
 
+    def get_possible_classes(self, class_name: str) -> Tuple[str, ...]:
+        """Get the class full names ending with the given class name"""
+        return tuple(c for c in self.method_dict if c.endswith(class_name))
+
+    def get_method_code(self, method_tag: Tag) -> str | None:
+        """Get the code of a method, thawed searchers read it from the store"""
+        if method_tag.code is not None or self.code_file is None:
+            return method_tag.code
+        if self.code_db is None:
+            # read-only, the tool lookups may run in other threads
+            self.code_db = sqlite3.connect(
+                f"file:{self.code_file}?mode=ro",
+                uri=True,
+                check_same_thread=False,
+            )
+        row = self.code_db.execute(
+            "SELECT code FROM method WHERE method_id = ?",
+            (method_tag.method_id,),
+        ).fetchone()
+        return row[0] if row else None
+
     def get_covered_classes(self):
         """Get a dictionary of all covered classes in the graph"""
         if self.covered_classes_result:
             return self.covered_classes_result
 
-        covered_test_classes = {}
-        covered_source_classes = {}
-        for node in self.graph.nodes(data=True):
-            if node[0].category == "function":
-                method_node: Tag = node[0]
-                if method_node.is_covered:
-                    full_class_name = method_node.outer_class
-                    if method_node.is_test:
-                        try:
-                            if (
-                                full_class_name
-                                not in covered_test_classes[
-                                    method_node.pkg_name
-                                ]
-                            ):
-                                covered_test_classes[
-                                    method_node.pkg_name
-                                ].append(full_class_name)
-                        except KeyError:
-                            covered_test_classes[method_node.pkg_name] = [
-                                method_node.outer_class
-                            ]
-                    else:
-                        try:
-                            if (
-                                full_class_name
-                                not in covered_source_classes[
-                                    method_node.pkg_name
-                                ]
-                            ):
-                                covered_source_classes[
-                                    method_node.pkg_name
-                                ].append(full_class_name)
-                        except KeyError:
-                            covered_source_classes[method_node.pkg_name] = [
-                                method_node.outer_class
-                            ]
+        # class names are deduplicated with dicts, which keep the insertion
+        # order, instead of a list scan per method
+        covered_test_classes: Dict[str, Dict[str, None]] = {}
+        covered_source_classes: Dict[str, Dict[str, None]] = {}
+        for method_node in self.method_nodes:
+            if method_node.is_covered:
+                if method_node.is_test:
+                    covered_classes = covered_test_classes
+                else:
+                    covered_classes = covered_source_classes
+                covered_classes.setdefault(method_node.pkg_name, {})[
+                    method_node.outer_class
+                ] = None
 
         template = (
             "Covered classes grouped with package name:\n\n"
@@ -291,8 +380,12 @@ class RepoSearcher:
             "Covered test classes:\n{covered_test_classes}"
         )
         result = template.format(
-            covered_source_classes=json.dumps(covered_source_classes),
-            covered_test_classes=json.dumps(covered_test_classes),
+            covered_source_classes=json.dumps(
+                {pkg: list(c) for pkg, c in covered_source_classes.items()}
+            ),
+            covered_test_classes=json.dumps(
+                {pkg: list(c) for pkg, c in covered_test_classes.items()}
+            ),
         )
         self.covered_classes_result = result
         return result
@@ -326,17 +419,14 @@ class RepoSearcher:
 
     def get_possible_method_ids(self, false_id):
         false_method_name = false_id.split("#")[0].split(".")[-1]
-        possible_method_ids = []
-        for node in self.graph.nodes(data=True):
-            if node[0].category == "function":
-                method_node: Tag = node[0]
-                if not method_node.is_covered:
-                    continue
-                if method_node.name == false_method_name:
-                    possible_method_ids.append(method_node.method_id)
+        possible_method_ids = set()
+        for method_node in self.method_nodes:
+            if not method_node.is_covered:
+                continue
+            if method_node.name == false_method_name:
+                possible_method_ids.add(method_node.method_id)
 
-        possible_method_ids = list(set(possible_method_ids))
-        return possible_method_ids
+        return list(possible_method_ids)
 
     def get_similar_candidates(
         self,
@@ -385,7 +475,7 @@ class RepoSearcher:
 
         result = (
             f'"Method ID": "{method_id}"\n'
-            f'"Method Code":\n```java\n{method_tag.code}\n```\n'
+            f'"Method Code":\n```java\n{self.get_method_code(method_tag)}\n```\n'
         )
         return result
 
@@ -427,11 +517,10 @@ class RepoSearcher:
     ):
         """Get a list of method IDs that match the method name and the class name (optional)"""
         try:
-            possible_methods = []
+            # deduplicate by method ID, keeping the first-found order
+            possible_methods: Dict[str, Tag] = {}
             if class_name:
-                possible_classes = [
-                    c for c in self.method_dict if c.endswith(class_name)
-                ]
+                possible_classes = self.get_possible_classes(class_name)
                 if not possible_classes:
                     raise ClassNameNotFoundError(class_name)
 
@@ -440,18 +529,19 @@ class RepoSearcher:
                     for m in class_methods:
                         if m.name != method_name:
                             continue
-                        if m not in possible_methods:
-                            possible_methods.append(m)
+                        possible_methods.setdefault(m.method_id, m)
             else:
-                for _, method_node in self.method_id_map.items():
+                # the method ID map holds every method once already
+                for method_node in self.method_id_map.values():
                     if method_node.name != method_name:
                         continue
-                    if method_node not in possible_methods:
-                        possible_methods.append(method_node)
+                    possible_methods[method_node.method_id] = method_node
 
             if not possible_methods:
                 raise MethodNotFoundError(method_name)
-            possible_methods = [m for m in possible_methods if m.is_covered]
+            possible_methods = [
+                m for m in possible_methods.values() if m.is_covered
+            ]
             method_dict = self.get_method_dict(possible_methods)
 
             result = (
@@ -464,7 +554,7 @@ class RepoSearcher:
 
 
 class NewRepoSearcher:
-    def __init__(self, graph: nx.MultiDiGraph):
+    def __init__(self, graph: "nx.MultiDiGraph"):
         self.graph = graph
         self.covered_classes_result = None
 
@@ -494,24 +584,30 @@ class NewRepoSearcher:
         self.method_dict = method_dict
         self.method_id_map = method_id_map
 
+        # the agents ask for the same class names again and again
+        self.get_possible_classes = functools.lru_cache(maxsize=1024)(
+            self.get_possible_classes
+        )
+
     def get_method(self, method_id) -> Tag | None:
         return self.method_id_map.get(method_id, None)
 
     def get_predecessors(self, node, edge_type):
+        # walk the raw adjacency dicts, each `graph[u][v]` builds a view
         predecessors = [
             u
-            for u in self.graph.pred[node]
-            for key in self.graph[u][node]
-            if self.graph[u][node][key]["rel"] == edge_type
+            for u, edges in self.graph._pred[node].items()
+            for data in edges.values()
+            if data["rel"] == edge_type
         ]
         return predecessors
 
     def get_successors(self, node, edge_type):
         successors = [
             v
-            for v in self.graph.succ[node]
-            for key in self.graph[node][v]
-            if self.graph[node][v][key]["rel"] == edge_type
+            for v, edges in self.graph._succ[node].items()
+            for data in edges.values()
+            if data["rel"] == edge_type
         ]
         return successors
 
@@ -520,43 +616,21 @@ class NewRepoSearcher:
         if self.covered_classes_result:
             return self.covered_classes_result
 
-        covered_test_classes = {}
-        covered_source_classes = {}
+        # class names are deduplicated with dicts, which keep the insertion
+        # order, instead of a list scan per method
+        covered_test_classes: Dict[str, Dict[str, None]] = {}
+        covered_source_classes: Dict[str, Dict[str, None]] = {}
         for node in self.graph.nodes(data=True):
             if node[0].category == "function":
                 method_node: Tag = node[0]
                 if method_node.is_covered:
-                    full_class_name = method_node.outer_class
                     if method_node.is_test:
-                        try:
-                            if (
-                                full_class_name
-                                not in covered_test_classes[
-                                    method_node.pkg_name
-                                ]
-                            ):
-                                covered_test_classes[
-                                    method_node.pkg_name
-                                ].append(full_class_name)
-                        except KeyError:
-                            covered_test_classes[method_node.pkg_name] = [
-                                method_node.outer_class
-                            ]
+                        covered_classes = covered_test_classes
                     else:
-                        try:
-                            if (
-                                full_class_name
-                                not in covered_source_classes[
-                                    method_node.pkg_name
-                                ]
-                            ):
-                                covered_source_classes[
-                                    method_node.pkg_name
-                                ].append(full_class_name)
-                        except KeyError:
-                            covered_source_classes[method_node.pkg_name] = [
-                                method_node.outer_class
-                            ]
+                        covered_classes = covered_source_classes
+                    covered_classes.setdefault(method_node.pkg_name, {})[
+                        method_node.outer_class
+                    ] = None
 
         template = (
             "Covered classes grouped with package name:\n\n"
@@ -564,25 +638,32 @@ class NewRepoSearcher:
             "Covered test classes:\n{covered_test_classes}"
         )
         result = template.format(
-            covered_source_classes=json.dumps(covered_source_classes),
-            covered_test_classes=json.dumps(covered_test_classes),
+            covered_source_classes=json.dumps(
+                {pkg: list(c) for pkg, c in covered_source_classes.items()}
+            ),
+            covered_test_classes=json.dumps(
+                {pkg: list(c) for pkg, c in covered_test_classes.items()}
+            ),
         )
         self.covered_classes_result = result
         return result
 
+    def get_possible_classes(self, class_name: str) -> Tuple[str, ...]:
+        """Get the class full names ending with the given class name"""
+        return tuple(c for c in self.method_dict if c.endswith(class_name))
+
     def get_possible_methods(
         self,
         class_name: str,
         method_name: str = None,
         covered_only: bool = False,
     ) -> List[Tag]:
-        possible_classes = [
-            c for c in self.method_dict if c.endswith(class_name)
-        ]
+        possible_classes = self.get_possible_classes(class_name)
         if not possible_classes:
             return None
 
-        possible_methods: List[Tag] = []
+        # deduplicate by method ID, keeping the first-found order
+        possible_methods: Dict[str, Tag] = {}
         for c in possible_classes:
             class_methods = self.method_dict[c]
             for m in class_methods:
@@ -591,9 +672,8 @@ class NewRepoSearcher:
                 if method_name:
                     if m.name != method_name:
                         continue
-                if m not in possible_methods:
-                    possible_methods.append(m)
-        return possible_methods
+                possible_methods.setdefault(m.method_id, m)
+        return list(possible_methods.values())
 
     def get_method_dict(self, methods: List[Tag]) -> Dict[str, List[str]]:
         """Get a dictionary of all methods grouped by class name"""
@@ -630,7 +710,8 @@ class NewRepoSearcher:
             return e.message
 
     def get_possible_method_ids(self, false_ids, covered_only=False):
-        all_possible_methods = []
+        # collect the ids into a set directly instead of deduplicating later
+        possible_ids = set()
         for false_id in false_ids:
             class_name = false_id.split(".")[-2]
             method_name = false_id.split(".")[-1].split("#")[0]
@@ -638,11 +719,9 @@ class NewRepoSearcher:
                 class_name, method_name, covered_only
             )
             if possible_methods:
-                all_possible_methods.extend(possible_methods)
+                possible_ids.update(m.method_id for m in possible_methods)
 
-        possible_ids = [m.method_id for m in all_possible_methods]
-        possible_ids = list(set(possible_ids))
-        return possible_ids
+        return list(possible_ids)
 
     def get_similar_candidates(
         self,
@@ -713,21 +792,14 @@ class NewRepoSearcher:
         except Exception as e:
             return e.message
 
-        methods = list(set(methods))
+        # the methods come from the method ID map, so they are unique
         suffix = ""
         if len(methods) > max_count:
-            methods = methods[:max_count]
             suffix = f"\n... and {len(methods) - max_count} more methods."
-        template = '{idx}. "{method_id}"'
+            methods = methods[:max_count]
         prefix = "The following methods contain the provided string content:\n"
         result = prefix + "\n".join(
-            [
-                template.format(
-                    idx=i + 1,
-                    method_id=m.method_id,
-                )
-                for i, m in enumerate(methods)
-            ]
+            [f'{i}. "{m.method_id}"' for i, m in enumerate(methods, 1)]
         )
         return result + suffix
 
@@ -2,8 +2,6 @@ from dataclasses import dataclass
 from pathlib import Path
 from typing import List, Optional, Tuple
 
-import networkx as nx
-
 from src.interfaces.method_extractor import JMethod
 
 
@@ -36,6 +34,29 @@ class Tag:
             (self.rel_fname, self.line, self.name, self.kind, self.category)
         )
 
+    def __reduce__(self):
+        # pickle the field values as a plain tuple instead of the instance
+        # dict, the repo graphs hold many tags and load faster this way
+        return (
+            Tag,
+            (
+                self.rel_fname,
+                self.fname,
+                self.line,
+                self.name,
+                self.kind,
+                self.category,
+                self.code,
+                self.pkg_name,
+                self.parent_class,
+                self.interfaces,
+                self.is_test,
+                self.outer_class,
+                self.inner_class,
+                self.is_covered,
+            ),
+        )
+
     @property
     def method_id(self):
         if self.category != "function":
@@ -119,13 +140,14 @@ class DebugInput:
     test_name: str
     test_code: str
     error_message: str
-    repo_graph: nx.Graph
-    loaded_classes: List[str]
+    repo_graph_file: Path
     output_path: Path
 
 
-@dataclass
+@dataclass(frozen=True)
 class SearchInput:
+    """Shared by all search processes of a test case, so it is read-only"""
+
     test_name: str
     test_code: str
     error_message: str
@@ -1,7 +1,14 @@
+import json
 import logging
 import time
 from contextlib import ContextDecorator
-from typing import Optional
+from pathlib import Path
+from typing import Any, Optional
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 
 class Timer(ContextDecorator):
@@ -19,3 +26,31 @@ class Timer(ContextDecorator):
         elapsed_time = end_time - self.start_time
         self.logger.debug(f"{self.desc} - time:{elapsed_time:.2f}s")
         return False
+
+
+def dump_json(obj: Any, file: Path, indent: Optional[int] = 2):
+    """Write `obj` to `file` as JSON, using orjson when it is available.
+    orjson only supports an indent of 2, any other indent is written as 2."""
+    if orjson is not None:
+        option = orjson.OPT_NON_STR_KEYS
+        if indent:
+            option |= orjson.OPT_INDENT_2
+        file.write_bytes(orjson.dumps(obj, option=option))
+    elif indent:
+        file.write_text(json.dumps(obj, indent=indent))
+    else:
+        file.write_text(json.dumps(obj, separators=(",", ":")))
+
+
+def load_json(file: Path) -> Any:
+    """Read a JSON file, using orjson when it is available"""
+    if orjson is not None:
+        return orjson.loads(file.read_bytes())
+    return json.loads(file.read_text())
+
+
+def loads_json(text: str | bytes) -> Any:
+    """Parse a JSON string, using orjson when it is available"""
+    if orjson is not None:
+        return orjson.loads(text)
+    return json.loads(text)
@@ -32,8 +32,6 @@ dataset_path = get_test_case_dataset_path(bug_info, test_case)
 repo_graph_file = dataset_path / "repograph.pkl"
 with repo_graph_file.open("rb") as f:
     repo_graph = pickle.load(f)
-loaded_classes_file = dataset_path / "loaded_classes.txt"
-loaded_classes = loaded_classes_file.read_text().split("\n")
 
 stack_trace_file = dataset_path / "stack_trace.txt"
 test_output_file = dataset_path / "test_output.txt"
@@ -50,8 +48,7 @@ debug_input = DebugInput(
     test_name=test_name,
     test_code=test_code,
     error_message=error_message,
-    repo_graph=repo_graph,
-    loaded_classes=loaded_classes,
+    repo_graph_file=repo_graph_file,
     output_path=output_path,
 )
 
@@ -1,15 +1,14 @@
 import argparse
-import json
-import multiprocessing
-import pickle
 import sys
 from argparse import Namespace
-from copy import deepcopy
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
 from pathlib import Path
-from typing import List
+from typing import Dict, List, Tuple
 
-import networkx as nx
+import numpy as np
 import pandas as pd
+from scipy.sparse.csgraph import shortest_path
 
 root = Path(__file__).resolve().parent.parent
 sys.path.append(str(root))
@@ -17,37 +16,59 @@ sys.path.append(str(root))
 from src.config import BugInfo
 from src.interfaces.d4j import get_failed_tests, get_properties
 from src.interfaces.method_extractor import JMethod
+from src.repograph.graph_arrays import UndirectedGraphs, load_undirected_graphs
 from src.schema import Tag, TestFailure
+from src.utils import dump_json, load_json
 
 
-def get_node_distance(graph: nx.MultiDiGraph, node1: Tag, node2: Tag):
-    dynamic_graph = nx.Graph()
-    combined_graph = nx.Graph()
-    for edge in graph.edges(data=True):
-        combined_graph.add_edge(edge[0], edge[1])
-        if edge[2]["rel"] == "calls":
-            dynamic_graph.add_edge(edge[0], edge[1])
+def get_distance_rows(undirected_graphs: UndirectedGraphs, node: Tag):
+    """
+    Get the number of edges on the shortest paths from the node to all
+    nodes, in the dynamic graph and in the combined graph (inf if there is
+    no path). A single BFS per graph answers all queries of the node.
+    """
+    node_ids, dynamic_graph, combined_graph = undirected_graphs
+    return [
+        shortest_path(
+            graph, directed=False, unweighted=True, indices=node_ids[node]
+        )
+        for graph in (dynamic_graph, combined_graph)
+    ]
 
+
+def get_node_distance(
+    undirected_graphs: UndirectedGraphs,
+    distance_rows: Dict[Tag, List[np.ndarray]],
+    node1: Tag,
+    node2: Tag,
+):
     # if the two nodes are the same, return 0
     if node1 == node2:
         return 0
 
-    # first try to find the shortest path in dynamic graph
-    try:
-        shortest_path = nx.shortest_path(dynamic_graph, node1, node2)
-        return len(shortest_path)
-    except Exception:
-        # if not found, try to find the shortest path in combined graph
-        try:
-            shortest_path = nx.shortest_path(combined_graph, node1, node2)
-            return len(shortest_path)
-        except Exception:
-            # if still not found, return -1
-            return -1
+    if node1 not in distance_rows:
+        distance_rows[node1] = get_distance_rows(undirected_graphs, node1)
+    target = undirected_graphs[0][node2]
+
+    # first try to find the shortest path in dynamic graph,
+    # if not found, try to find the shortest path in combined graph
+    for row in distance_rows[node1]:
+        if np.isfinite(row[target]):
+            # the distance is the number of nodes on the path
+            return int(row[target]) + 1
+    # if still not found, return -1
+    return -1
+
+
+def get_function_nodes(nodes: List[Tag]) -> List[Tag]:
+    return [node for node in nodes if node.category == "function"]
 
 
 def get_relative_distance(
-    combined_graph: nx.MultiDiGraph,
+    function_nodes: List[Tag],
+    name_index: Dict[str, List[Tuple[int, Tag]]],
+    undirected_graphs: UndirectedGraphs,
+    distance_rows: Dict[Tag, List[np.ndarray]],
     modified_methods: List[JMethod],
     pred_method_sig: str,
 ):
@@ -57,33 +78,34 @@ def get_relative_distance(
     For example, if the number of buggy methods is 3,
     the output will be a list contains 3 distances such as [2, 3, 4].
     """
-
-    def fuzzy_match(method_tag: Tag, method_sig: str):
-        identifiers = method_sig.split("(")[0].split(".")
-        buggy_class = method_tag.outer_class
-        buggy_method_name = method_tag.name
-        if buggy_class in identifiers and buggy_method_name in identifiers:
-            return True
-        return False
-
     buggy_nodes = []
-    predict_node = None
-    should_find_methods = deepcopy(modified_methods)
-    for nodes in combined_graph.nodes(data=True):
-        if nodes[0].category == "function":
-            method_node: Tag = nodes[0]
-            for m in should_find_methods:
-                if method_node.outer_class in m.class_name:
-                    if m.name == method_node.name:
-                        if (
-                            m.loc[0][0] + 1 <= method_node.line[0]
-                            and m.loc[1][0] + 1 >= method_node.line[1]
-                        ):
-                            buggy_nodes.append(method_node)
-                            should_find_methods.remove(m)
-                            break
-            if fuzzy_match(method_node, pred_method_sig):
-                predict_node = method_node
+    # only the list is mutated, the methods themselves are never modified
+    should_find_methods = list(modified_methods)
+    for method_node in function_nodes:
+        if not should_find_methods:
+            break
+        for m in should_find_methods:
+            if method_node.outer_class in m.class_name:
+                if m.name == method_node.name:
+                    if (
+                        m.loc[0][0] + 1 <= method_node.line[0]
+                        and m.loc[1][0] + 1 >= method_node.line[1]
+                    ):
+                        buggy_nodes.append(method_node)
+                        should_find_methods.remove(m)
+                        break
+
+    # fuzzy match: both the class and the method name of the node are
+    # identifiers of the signature, so only nodes named by one of the
+    # identifiers are checked. The last match in the graph wins.
+    identifiers = pred_method_sig.split("(")[0].split(".")
+    matches = [
+        (pos, method_node)
+        for name in set(identifiers)
+        for pos, method_node in name_index.get(name, [])
+        if method_node.outer_class in identifiers
+    ]
+    predict_node = max(matches, key=lambda x: x[0])[1] if matches else None
 
     assert (
         len(should_find_methods) == 0
@@ -95,7 +117,9 @@ def get_relative_distance(
 
     distances = []
     for buggy_node in buggy_nodes:
-        distance = get_node_distance(combined_graph, buggy_node, predict_node)
+        distance = get_node_distance(
+            undirected_graphs, distance_rows, buggy_node, predict_node
+        )
         if distance != -1:
             distances.append(distance)
     return distances
@@ -106,20 +130,28 @@ def get_distance(
 ):
     modified_methods = test_failure_obj.buggy_methods
 
-    graph_file = bug_info.bug_path / "combined_graph.pkl"
-    with graph_file.open("rb") as f:
-        combined_graph = pickle.load(f)
+    nodes, undirected_graphs = load_undirected_graphs(bug_info.bug_path)
 
-    with autofl_res_file.open("r") as f:
-        pred_method_sigs = json.load(f)
+    pred_method_sigs = load_json(autofl_res_file)
 
     if not pred_method_sigs:
         return [0]
 
+    function_nodes = get_function_nodes(nodes)
+    name_index = {}
+    for pos, node in enumerate(function_nodes):
+        name_index.setdefault(node.name, []).append((pos, node))
+    # distances from each buggy node, computed on first use
+    distance_rows = {}
     evaluate_result = []
     for pred_method_sig in pred_method_sigs:
         distances = get_relative_distance(
-            combined_graph, modified_methods, pred_method_sig
+            function_nodes,
+            name_index,
+            undirected_graphs,
+            distance_rows,
+            modified_methods,
+            pred_method_sig,
         )
         if distances:
             rd = max([1 / (d + 1) for d in distances])
@@ -146,8 +178,17 @@ def evaluate(project, bugID, config, autofl_res_file):
     test_failure_obj = get_failed_tests(bug_info)
 
     distances = get_distance(bug_info, test_failure_obj, autofl_res_file)
-    with result_file.open("w") as f:
-        json.dump(distances, f)
+    dump_json(distances, result_file, indent=None)
+
+
+def evaluate_bug(bug_name, config, autofl_res_file):
+    """Report the error of a bug instead of stopping the whole pool"""
+    proj, bug_id = bug_name.split("_")
+    try:
+        evaluate(proj, bug_id, config, autofl_res_file)
+    except Exception as e:
+        return str(e)
+    return None
 
 
 def print_result(bug_names, config_file):
@@ -160,8 +201,7 @@ def print_result(bug_names, config_file):
         )
         if not distance_file.exists():
             raise FileNotFoundError(f"{distance_file} not found, please check")
-        with distance_file.open("r") as f:
-            distance = json.load(f)
+        distance = load_json(distance_file)
 
         if proj not in output:
             output[proj] = {
@@ -195,29 +235,33 @@ def print_result(bug_names, config_file):
 
 
 def main(dataset_file, autofl_res_dir, config_file, processes):
-    df = pd.read_csv(dataset_file, header=None)
+    df = pd.read_csv(dataset_file, header=None, usecols=[0])
     bug_names = df.iloc[:, 0].tolist()
 
     # TODO: evaluation: control bug for test
     # bug_names = ["Closure_1"]
     bug_names = [b for b in bug_names if b.startswith("Closure")]
 
-    with multiprocessing.Pool(processes=processes) as pool:
-        async_results = []
-        for bug_name in bug_names:
-            proj, bug_id = bug_name.split("_")
-            autofl_res_file = Path(autofl_res_dir) / f"{bug_name}.json"
-            async_result = pool.apply_async(
-                evaluate, (proj, bug_id, config_file, autofl_res_file)
-            )
-            async_results.append(async_result)
-
-        for async_result in async_results:
-            try:
-                async_result.get()
-            except Exception as e:
-                print(e)
-                return
+    autofl_res_files = [
+        Path(autofl_res_dir) / f"{bug_name}.json" for bug_name in bug_names
+    ]
+    # amortize the dispatch overhead over chunks of bugs
+    chunksize = max(1, len(bug_names) // (processes * 4))
+    failed = False
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        errors = executor.map(
+            evaluate_bug,
+            bug_names,
+            repeat(config_file),
+            autofl_res_files,
+            chunksize=chunksize,
+        )
+        for error in errors:
+            if error is not None:
+                print(error)
+                failed = True
+    if failed:
+        return
 
     print_result(bug_names, config_file)
 